@@ -1,55 +1,283 @@
-from flask import Flask, request
-from dotenv import load_dotenv
-import os
+from quart import Quart, request
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import logging.handlers
+import platform
+import queue
+import re
+import sys
+from config import ENV
 from call_handler_org import CallHandler
 
-# Load environment variables
-load_dotenv()
+# Concurrent /call requests are coalesced into one flush of up to BATCH_MAX
+# dials, sent BATCH_WAIT_MS after the first request in the batch arrives
+BATCH_MAX = int(ENV.get('BATCH_MAX', 32))
+BATCH_WAIT_MS = int(ENV.get('BATCH_WAIT_MS', 20))
 
-app = Flask(__name__)
+# Status callbacks are acknowledged immediately and processed in the background;
+# past this backlog Twilio gets a 503 and retries later
+STATUS_HIGH_WATER = int(ENV.get('STATUS_HIGH_WATER', 1000))
+# Status updates are applied by this many consumers, sharded by CallSid so each
+# call's updates are still applied in order
+STATUS_WORKERS = int(ENV.get('STATUS_WORKERS', 4))
+
+# Prefer orjson for request parsing, fall back to the stdlib
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# Twilio dials E.164 numbers; libphonenumber adds a per-region validity check when installed
+PHONE_NUMBER_RE = re.compile(r'^\+[1-9]\d{7,14}$')
+try:
+    import phonenumbers
+except ImportError:
+    phonenumbers = None
+
+def is_valid_phone_number(number):
+    """Validate a dial target locally so malformed numbers never reach Twilio"""
+    if not isinstance(number, str) or not PHONE_NUMBER_RE.match(number):
+        return False
+    if phonenumbers is None:
+        return True
+    try:
+        return phonenumbers.is_valid_number(phonenumbers.parse(number, None))
+    except phonenumbers.NumberParseException:
+        return False
+
+# The healthcheck body never changes, so serialize it once
+INDEX_BODY = json_dumps({
+    'status': 'online',
+    'message': 'Real Estate Telecaller System is running',
+    'endpoints': {
+        'initiate_call': '/call',
+        'twilio_webhooks': ['/webhook/voice', '/webhook/status', '/webhook/speech']
+    }
+})
+INDEX_ETAG = '"' + hashlib.blake2b(INDEX_BODY, digest_size=8).hexdigest() + '"'
+INDEX_HEADERS = {
+    'Content-Type': 'application/json',
+    'ETag': INDEX_ETAG,
+    'Cache-Control': 'public, max-age=5'
+}
+
+def install_event_loop_policy():
+    """Use io_uring on Linux 5.11+, uvloop elsewhere, and the stdlib loop if neither is installed"""
+    if sys.platform == 'linux':
+        match = re.match(r'(\d+)\.(\d+)', platform.release())
+        if match and (int(match.group(1)), int(match.group(2))) >= (5, 11):
+            try:
+                import uringcore
+                asyncio.set_event_loop_policy(uringcore.EventLoopPolicy())
+                return 'uringcore'
+            except ImportError:
+                pass
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return 'uvloop'
+    except ImportError:
+        return 'asyncio'
+
+# Must run before the server creates its loop; Uvicorn workers import the app first,
+# and the gunicorn worker class tells Uvicorn not to replace the policy
+EVENT_LOOP = install_event_loop_policy()
+
+# Twilio signs every webhook with HMAC-SHA1 over the public URL and the sorted form
+# fields; validation is on whenever the auth token and public URL are configured
+SERVER_URL = ENV.get('SERVER_URL', '').rstrip('/')
+SIGNATURE_MAC = (
+    hmac.new(ENV['TWILIO_AUTH_TOKEN'].encode('utf-8'), digestmod=hashlib.sha1)
+    if ENV.get('TWILIO_AUTH_TOKEN') and SERVER_URL else None
+)
+
+def is_valid_twilio_request(form):
+    """Check the X-Twilio-Signature header against the request URL and form"""
+    if SIGNATURE_MAC is None:
+        return True
+    mac = SIGNATURE_MAC.copy()
+    mac.update((SERVER_URL + request.path).encode('utf-8'))
+    if request.query_string:
+        mac.update(b'?' + request.query_string)
+    for key in sorted(form.keys()):
+        for value in sorted(form.getlist(key)):
+            mac.update((key + value).encode('utf-8'))
+    expected = base64.b64encode(mac.digest()).decode('ascii')
+    return hmac.compare_digest(expected, request.headers.get('X-Twilio-Signature', ''))
+
+def build_http_session():
+    """Build the keep-alive connection pool shared by all outbound API calls"""
+    session = Session()
+    session.mount('https://', HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        # urllib3 retries only idempotent methods, so these status retries cover GETs
+        # such as the warmup fetch; Azure completions and Twilio dials are POSTs and
+        # are never retried, so a call is never placed twice
+        max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=(429, 502, 503, 504))
+    ))
+    return session
+
+app = Quart(__name__)
+# Twilio form posts are a few KB; refuse anything larger before it is parsed
+app.config['MAX_CONTENT_LENGTH'] = int(ENV.get('MAX_CONTENT_LENGTH', 64 * 1024))
 call_handler = CallHandler()
+call_queue = None
+status_queues = []
+log_listener = None
+batch_tasks = set()
+
+def submit_dial(to_number):
+    """Start a dial, turning a failure to submit into an awaitable exception"""
+    try:
+        return asyncio.wrap_future(call_handler.submit_call(to_number))
+    except Exception as e:
+        failed = asyncio.get_running_loop().create_future()
+        failed.set_exception(e)
+        return failed
+
+async def flush_call_batch(batch):
+    """Dial every number in the batch concurrently over the shared connection pool"""
+    # A submit that raises fails only its own request, not the whole batch
+    results = await asyncio.gather(
+        *(submit_dial(to_number) for to_number, _ in batch),
+        return_exceptions=True
+    )
+    for (_, future), result in zip(batch, results):
+        if future.done():
+            continue
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+async def drain_call_queue():
+    """Collect queued dials until the batch is full or the wait window closes"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await call_queue.get()]
+        deadline = loop.time() + BATCH_WAIT_MS / 1000
+        while len(batch) < BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(call_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Flush in the background so the next batch can start filling
+        task = loop.create_task(flush_call_batch(batch))
+        batch_tasks.add(task)
+        task.add_done_callback(batch_tasks.discard)
+
+@app.before_serving
+async def start_log_listener():
+    # Request threads only enqueue log records; a listener thread in this serving
+    # process formats them and writes to the root logger's handlers
+    global log_listener
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    log_listener.start()
+
+@app.after_serving
+async def stop_log_listener():
+    # Flush queued records through the original handlers before the process exits
+    root = logging.getLogger()
+    root.handlers = list(log_listener.handlers)
+    log_listener.stop()
+
+@app.before_serving
+async def start_call_handler():
+    # Runs in each serving process, after gunicorn forks it from the preloaded master
+    await asyncio.to_thread(call_handler.start, build_http_session())
+
+@app.before_serving
+async def warmup_connections():
+    # WARMUP=0 skips the outbound API calls, e.g. for local testing
+    if ENV.get('WARMUP', '1') == '1':
+        await asyncio.to_thread(call_handler.warmup)
+
+@app.before_serving
+async def start_call_batcher():
+    global call_queue
+    call_queue = asyncio.Queue()
+    app.add_background_task(drain_call_queue)
+
+async def drain_status_queue(status_queue):
+    """Apply one shard's queued call status updates in arrival order"""
+    while True:
+        get_param = await status_queue.get()
+        await asyncio.to_thread(call_handler.handle_call_status, get_param)
+
+@app.before_serving
+async def start_status_workers():
+    for _ in range(STATUS_WORKERS):
+        status_queue = asyncio.Queue()
+        status_queues.append(status_queue)
+        app.add_background_task(drain_status_queue, status_queue)
 
 @app.route('/call', methods=['POST'])
-def initiate_call():
+async def initiate_call():
     """Endpoint to initiate a call to a target number"""
-    data = request.get_json()
-    # Fixed this line - it was using incorrect syntax for accessing the JSON data
-    to_number = data.get('to_number')
+    try:
+        data = json_loads(await request.get_data(cache=False))
+    except ValueError:
+        return {'error': 'Request body must be valid JSON'}, 400
+
+    to_number = data.get('to_number') if isinstance(data, dict) else None
     if not to_number:
         return {'error': 'Please provide a target phone number'}, 400
-        
-    result = call_handler.initiate_call(to_number)
-    return result
+    # Reject malformed numbers before they cost a Twilio round-trip
+    if not is_valid_phone_number(to_number):
+        return {'error': 'Please provide a valid phone number in E.164 format'}, 400
+
+    # Queue the dial and wait for the batcher to resolve it
+    future = asyncio.get_running_loop().create_future()
+    call_queue.put_nowait((to_number, future))
+    return await future
+
+WEBHOOK_HANDLERS = {
+    'voice': call_handler.handle_incoming_call,
+    'speech': call_handler.handle_speech_input,
+}
 
-@app.route('/webhook/voice', methods=['POST'])
-def handle_incoming_call():
-    """Webhook for handling incoming Twilio call"""
-    return call_handler.handle_incoming_call(request.form)
+@app.route('/webhook/<event>', methods=['POST'])
+async def handle_webhook(event):
+    """Single entry point for Twilio voice, status and speech webhooks"""
+    if event != 'status' and event not in WEBHOOK_HANDLERS:
+        return '', 404
 
-@app.route('/webhook/status', methods=['POST'])
-def handle_call_status():
-    """Webhook for handling call status updates"""
-    return call_handler.handle_call_status(request.form)
+    form = await request.form
+    if not is_valid_twilio_request(form):
+        return '', 403
 
-@app.route('/webhook/speech', methods=['POST'])
-def handle_speech_input():
-    """Webhook for handling speech input during the call"""
-    return call_handler.handle_speech_input(request.form)
+    # Status updates are acknowledged immediately and applied in the background
+    if event == 'status':
+        if sum(status_queue.qsize() for status_queue in status_queues) > STATUS_HIGH_WATER:
+            return '', 503
+        status_queues[hash(form.get('CallSid', '')) % STATUS_WORKERS].put_nowait(form.get)
+        return '', 204
+
+    return await asyncio.to_thread(WEBHOOK_HANDLERS[event], form.get)
 
 @app.route('/', methods=['GET'])
-def index():
+async def index():
     """Root endpoint to confirm the server is running"""
-    return {
-        'status': 'online',
-        'message': 'Real Estate Telecaller System is running',
-        'endpoints': {
-            'initiate_call': '/call',
-            'twilio_webhooks': ['/webhook/voice', '/webhook/status', '/webhook/speech']
-        }
-    }
-
-if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
-    print(f"Server running on port {port}")
-    print("Real Estate Telecaller System is ready to make calls")
\ No newline at end of file
+    # Repeat healthcheck polls only need the status line
+    if request.headers.get('If-None-Match') == INDEX_ETAG:
+        return '', 304, {'ETag': INDEX_ETAG}
+    return INDEX_BODY, 200, INDEX_HEADERS
@@ -2,14 +2,38 @@ import os
 import logging
 import json
 import time
-import traceback
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Callable, AsyncIterator
 import re
+import string
 import asyncio
 import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from itertools import islice
 import azure.cognitiveservices.speech as speechsdk
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+# Imported once per process; AzureServices reports the missing packages instead of failing import
+try:
+    import openai
+    from azure.identity import DefaultAzureCredential
+    AZURE_IMPORT_ERROR = None
+except ImportError as e:
+    openai = None
+    DefaultAzureCredential = None
+    AZURE_IMPORT_ERROR = e
+
+# Optional local voice activity detection to avoid sending silence to Azure
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+# Raw PCM handed to recognize_speech is 16 kHz, 16-bit mono
+PCM_SAMPLE_RATE = 16000
+NO_SPEECH_MESSAGE = "I didn't hear that clearly. Could you repeat your question about real estate?"
+
 # Set up logging with more detailed configuration
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +45,246 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Common real estate intents for faster response mapping
+REAL_ESTATE_INTENTS = {
+    "buying": ["looking to buy", "interested in purchasing", "want to buy", "buying a home"],
+    "selling": ["want to sell", "selling my house", "list my property", "selling process"],
+    "investing": ["investment property", "rental income", "flip houses", "real estate investing"],
+    "financing": ["mortgage", "loan options", "interest rates", "down payment", "pre-approval"],
+    "market": ["market conditions", "housing prices", "appreciation", "market trends"],
+    "property": ["square footage", "bedrooms", "bathrooms", "features", "amenities"],
+    "process": ["closing costs", "inspection", "appraisal", "escrow", "contingencies"],
+    "location": ["neighborhood", "school district", "community", "location"]
+}
+
+# One pattern for all intent keywords; each branch scans the whole query before
+# the next is tried, so the first intent listed above still wins
+INTENT_RE = re.compile(
+    '^(?:' + '|'.join(
+        f'.*?(?P<{intent}>' + '|'.join(re.escape(keyword) for keyword in keywords) + ')'
+        for intent, keywords in REAL_ESTATE_INTENTS.items()
+    ) + ')',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Sentence boundaries used to hand streamed text to speech as soon as it is complete
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Answers to questions about current conditions go stale, so they are never cached
+TIME_SENSITIVE_RE = re.compile(
+    r'\b(?:today|tonight|now|currently|current|latest|this (?:week|month|year))\b',
+    re.IGNORECASE
+)
+# Punctuation stripped from normalized queries; hyphens carry meaning in terms like pre-approval
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation.replace("-", ""))
+
+# Response templates for quicker generation
+RESPONSE_TEMPLATES = {
+    "greeting": "Hello! I'm your real estate assistant. How can I help you today with your real estate questions?",
+    "clarification": "I'm not quite sure I understood that. Could you rephrase your question about {topic}?",
+    "transition": "Is there anything else you'd like to know about {topic}?",
+    "closing": "Thank you for chatting about real estate today. Is there anything else I can help with?",
+    "handoff": "That's a great question that might need personalized advice. Would you like me to connect you with a human agent to discuss {topic} in more detail?"
+}
+
+# Common speech recognition errors in real estate context
+SPEECH_CORRECTIONS = {
+    # Addresses and locations
+    "addresses": "addresses",
+    "zip code": "zip code",
+    "street address": "street address",
+    "nearby": "nearby",
+    "neighborhood": "neighborhood",
+    "school district": "school district",
+
+    # Real estate terms
+    "pre approval": "pre-approval",
+    "preapproval": "pre-approval",
+    "pre qualify": "pre-qualify",
+    "prequalify": "pre-qualify",
+    "f h a": "FHA",
+    "fha": "FHA",
+    "v a": "VA",
+    "va loan": "VA loan",
+    "h o a": "HOA",
+    "hoa fees": "HOA fees",
+    "homeowners association": "homeowners association",
+    "condo": "condo",
+    "condominium": "condominium",
+    "townhouse": "townhouse",
+    "town home": "townhome",
+    "duplex": "duplex",
+    "triplex": "triplex",
+    "single family": "single-family",
+    "multi family": "multi-family",
+    "multifamily": "multi-family",
+
+    # Financial terms
+    "down payment": "down payment",
+    "closing costs": "closing costs",
+    "escrow": "escrow",
+    "earnest money": "earnest money",
+    "interest rate": "interest rate",
+    "adjustable rate": "adjustable rate",
+    "fixed rate": "fixed rate",
+    "mortgage": "mortgage",
+    "loan": "loan",
+    "refinance": "refinance",
+    "refinancing": "refinancing",
+    "cash flow": "cash flow",
+    "net operating income": "net operating income",
+    "noi": "NOI",
+    "cap rate": "cap rate",
+    "capitalization rate": "capitalization rate",
+    "roi": "ROI",
+    "return on investment": "return on investment",
+    "cash on cash": "cash-on-cash",
+    "appreciation": "appreciation",
+    "equity": "equity",
+    "leverage": "leverage",
+}
+
+# Common real estate terms added to the recognizer's phrase list
+REAL_ESTATE_PHRASES = (
+    "real estate", "realtor", "property", "mortgage", "interest rate",
+    "down payment", "pre-approval", "escrow", "closing costs", "appraisal",
+    "inspection", "contingencies", "HOA", "buyer's agent", "listing agent",
+    "equity", "appreciation", "amortization", "capitalization rate",
+    "cash flow", "investment property", "rental income", "fix and flip",
+    "cash-on-cash return", "ROI", "property management", "refinance",
+    "conventional loan", "FHA loan", "VA loan", "USDA loan", "jumbo loan",
+    "seller's market", "buyer's market", "multiple listing service",
+    "comparables", "days on market", "inventory", "pending sale"
+)
+
+# Phonetic alternatives for commonly misheard real estate terms
+PHONETIC_ALTERNATIVES = {
+    "reeltor": "realtor",
+    "reel estate": "real estate",
+    "reel a state": "real estate",
+    "morgage": "mortgage",
+    "morgidge": "mortgage",
+    "escroh": "escrow",
+    "iscrow": "escrow",
+    "contingensee": "contingency",
+    "preapruval": "pre-approval",
+    "howa": "HOA",
+    "h o way": "HOA",
+    "capperate": "cap rate",
+    "cash on cash": "cash-on-cash",
+    "eckwity": "equity",
+    "square foot-age": "square footage",
+    "square feet-age": "square footage"
+}
+
+# Merge both maps into one alternation, compiled once per process, so each
+# utterance is scanned once; phonetic fixes win on overlap and longer terms are tried first
+CORRECTION_MAP = {**SPEECH_CORRECTIONS, **PHONETIC_ALTERNATIVES}
+CORRECTION_RE = re.compile(
+    r'\b(' + '|'.join(re.escape(term) for term in sorted(CORRECTION_MAP, key=len, reverse=True)) + r')\b',
+    re.IGNORECASE
+)
+# Every correction begins with one of these words; utterances with none of them skip the regex
+WORD_RE = re.compile(r'\w+')
+CORRECTION_FIRST_TOKENS = frozenset(WORD_RE.match(term).group() for term in CORRECTION_MAP)
+
+# System prompt shared by every intent, plus intent-specific guidance
+BASE_SYSTEM_PROMPT = """
+You are a highly knowledgeable real estate assistant working for Premier Real Estate Services.
+Your role is to provide accurate, helpful information about all aspects of real estate.
+
+When responding to queries:
+1. ALWAYS provide specific, actionable information rather than vague statements
+2. Use natural conversational language suitable for a phone call (use contractions, avoid overly formal language)
+3. Break information into concise, digestible chunks
+4. Limit responses to under 100 words when possible to maintain engagement
+5. When discussing financial information, provide specific ranges and percentages when appropriate
+6. Always acknowledge the question first before answering
+7. End your response with a natural conversational transition or brief follow-up question
+"""
+
+INTENT_GUIDANCE = {
+    "buying": """
+    Focus on buyer-specific information. Emphasize the buying process, making offers,
+    negotiation strategies, financing options, and first-time homebuyer considerations.
+    Mention typical timelines (30-45 days for closing) and buyer closing costs (2-5%).
+    """,
+
+    "selling": """
+    Focus on seller-specific information. Emphasize pricing strategies, marketing properties,
+    staging, negotiating offers, seller closing costs (6-10%), and typical timelines (60-90 days).
+    Discuss market conditions relevant to sellers and preparation for selling.
+    """,
+
+    "investing": """
+    Focus on investment property information. Emphasize ROI calculations, cap rates (good range is 4-10%),
+    cash flow analysis, rental property management (costs typically 8-12% of rent),
+    and investment strategies (fix-and-flip, buy-and-hold, etc.).
+    """,
+
+    "financing": """
+    Focus on mortgage and financing information. Emphasize loan types, down payment requirements,
+    interest rates, pre-approval process, closing costs, debt-to-income ratios (typically 43% max),
+    and credit score impacts (620+ for conventional, 580+ for FHA).
+    """,
+
+    "market": """
+    Focus on market condition information. Emphasize current trends, supply and demand dynamics,
+    appreciation factors, seasonality impacts, inventory levels, and neighborhood analysis factors.
+    Discuss indicators of buyer's vs seller's markets.
+    """,
+
+    "property": """
+    Focus on property-specific information. Emphasize property types, construction, home systems,
+    condition assessments, square footage considerations, lot size importance, and feature valuations.
+    Discuss how various features impact property value.
+    """,
+
+    "process": """
+    Focus on real estate process information. Emphasize purchase contracts, contingencies,
+    escrow, closing process, title insurance, property disclosures, and real estate regulations.
+    Explain typical timelines and what to expect at each stage.
+    """,
+
+    "location": """
+    Focus on location-specific information. Emphasize neighborhood evaluation, school districts
+    (10-20% premium for top districts), crime considerations, proximity to amenities,
+    transportation factors, future development impacts, and property tax variations.
+    """
+}
+
+# Full system prompt per intent, built once instead of per query
+SYSTEM_PROMPTS = {intent: BASE_SYSTEM_PROMPT + "\n" + guidance for intent, guidance in INTENT_GUIDANCE.items()}
+SYSTEM_PROMPTS["general"] = BASE_SYSTEM_PROMPT
+
+class AnswerCache:
+    """Small thread-safe LRU cache whose entries expire after a fixed TTL"""
+    
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
 class AzureServices:
     """
     Enhanced integration with Azure OpenAI for real estate AI assistant.
@@ -29,10 +293,18 @@ class AzureServices:
     
     def __init__(self):
         """Initialize Azure OpenAI integration with proper error handling and expanded capabilities"""
+        # Dedicated threads for blocking SDK calls, kept apart from the default executor
+        self._azure_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="azure")
+        
+        # Most aggressive mode: only clear speech counts as speech
+        self._vad = webrtcvad.Vad(3) if webrtcvad is not None else None
+        
         try:
-            # Import Azure OpenAI SDK
-            import openai
-            from azure.identity import DefaultAzureCredential
+            if openai is None:
+                logger.error("Required Azure packages not found: %s", AZURE_IMPORT_ERROR)
+                logger.error("Install required packages with: pip install openai azure-identity azure-cognitiveservices-speech tenacity")
+                self.client = None
+                return
             
             # Get Azure OpenAI settings from environment variables
             self.api_key = os.environ.get('AZURE_OPENAI_API_KEY')
@@ -43,6 +315,11 @@ class AzureServices:
             self.speech_key = os.environ.get('AZURE_SPEECH_KEY')
             self.speech_region = os.environ.get('AZURE_SPEECH_REGION', 'eastus')
             
+            # Managed identity token state, see _get_bearer
+            self._token = None
+            self._token_expires_on = 0
+            self._token_lock = threading.Lock()
+            
             # Set up OpenAI client for Azure
             if self.api_key and self.endpoint:
                 openai.api_type = "azure"
@@ -52,13 +329,12 @@ class AzureServices:
                 self.client = openai
                 logger.info("Azure OpenAI client initialized successfully with API key")
             elif self.endpoint:
-                # Use Azure managed identity if available but no API key
-                self.credential = DefaultAzureCredential()
-                openai.api_type = "azure"
+                # Use Azure managed identity if available but no API key; the credential
+                # and bearer token are fetched on first use and refreshed before expiry
+                self.credential = None
+                openai.api_type = "azure_ad"
                 openai.api_base = self.endpoint
                 openai.api_version = "2023-07-01-preview"  # Updated API version
-                token = self.credential.get_token("https://cognitiveservices.azure.com/.default")
-                openai.api_key = token.token
                 self.client = openai
                 logger.info("Azure OpenAI client initialized with managed identity")
             else:
@@ -75,13 +351,8 @@ class AzureServices:
             self._init_advanced_speech_processing()
             
             logger.info("Azure services initialization completed")
-        except ImportError as e:
-            logger.error(f"Required Azure packages not found: {str(e)}")
-            logger.error("Install required packages with: pip install openai azure-identity azure-cognitiveservices-speech tenacity")
-            self.client = None
         except Exception as e:
-            logger.error(f"Error initializing Azure services: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error initializing Azure services: %s", e)
             self.client = None
     
     def _init_speech_services(self):
@@ -105,13 +376,25 @@ class AzureServices:
                 # Set up custom pronunciation for real estate terms (if available)
                 # self.speech_config.endpoint_id = "YOUR_CUSTOM_PRONUNCIATION_ENDPOINT"
                 
-                # Create speech recognizer
+                # Create speech recognizer fed from a push stream; call audio arrives via push_pcm
+                self._push_stream = speechsdk.audio.PushAudioInputStream(
+                    speechsdk.audio.AudioStreamFormat(
+                        samples_per_second=PCM_SAMPLE_RATE, bits_per_sample=16, channels=1
+                    )
+                )
+                self._push_clock = 0.0
                 self.speech_recognizer = speechsdk.SpeechRecognizer(
-                    speech_config=self.speech_config
+                    speech_config=self.speech_config,
+                    audio_config=speechsdk.audio.AudioConfig(stream=self._push_stream)
                 )
                 
-                # Configure continuous recognition settings for better performance
-                self.speech_recognizer.recognized.connect(self._process_recognized_speech)
+                # Surface interim hypotheses; the short segmentation timeout above only
+                # lowers latency if callers can act on partial text
+                self._partial_cb = None
+                self.speech_recognizer.recognizing.connect(self._on_partial)
+                
+                # Opened by warmup() so the first recognition skips the handshake
+                self._connection = speechsdk.Connection.from_recognizer(self.speech_recognizer)
                 
                 logger.info("Speech services initialized successfully")
             else:
@@ -119,116 +402,30 @@ class AzureServices:
                 self.speech_config = None
                 self.speech_recognizer = None
         except Exception as e:
-            logger.error(f"Error initializing speech services: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error initializing speech services: %s", e)
             self.speech_config = None
             self.speech_recognizer = None
     
     def _init_conversation_context(self):
         """Initialize conversation context management for better continuity"""
         # Store conversation history for context
-        self.conversation_history = []
         self.max_history_length = 10  # Keep last 10 exchanges for context
+        # Bounded buffer drops the oldest entries itself, *2 because each exchange has two entries
+        self.conversation_history = deque(maxlen=self.max_history_length * 2)
+        # SDK callbacks arrive on native threads, so history access is serialized
+        self._history_lock = threading.Lock()
         
-        # Common real estate intents for faster response mapping
-        self.real_estate_intents = {
-            "buying": ["looking to buy", "interested in purchasing", "want to buy", "buying a home"],
-            "selling": ["want to sell", "selling my house", "list my property", "selling process"],
-            "investing": ["investment property", "rental income", "flip houses", "real estate investing"],
-            "financing": ["mortgage", "loan options", "interest rates", "down payment", "pre-approval"],
-            "market": ["market conditions", "housing prices", "appreciation", "market trends"],
-            "property": ["square footage", "bedrooms", "bathrooms", "features", "amenities"],
-            "process": ["closing costs", "inspection", "appraisal", "escrow", "contingencies"],
-            "location": ["neighborhood", "school district", "community", "location"]
-        }
+        # Repeat questions are answered from memory instead of another OpenAI call
+        self._answer_cache = AnswerCache(maxsize=1024, ttl=3600)
         
-        # Response templates for quicker generation
-        self.response_templates = {
-            "greeting": "Hello! I'm your real estate assistant. How can I help you today with your real estate questions?",
-            "clarification": "I'm not quite sure I understood that. Could you rephrase your question about {topic}?",
-            "transition": "Is there anything else you'd like to know about {topic}?",
-            "closing": "Thank you for chatting about real estate today. Is there anything else I can help with?",
-            "handoff": "That's a great question that might need personalized advice. Would you like me to connect you with a human agent to discuss {topic} in more detail?"
-        }
+        # Intent keywords and templates are shared module-level tables
+        self.real_estate_intents = REAL_ESTATE_INTENTS
+        self.response_templates = RESPONSE_TEMPLATES
     
     def _init_advanced_speech_processing(self):
         """Initialize advanced speech processing for better recognition"""
-        # Common speech recognition errors in real estate context
-        self.speech_corrections = {
-            # Addresses and locations
-            "addresses": "addresses",
-            "zip code": "zip code",
-            "street address": "street address",
-            "nearby": "nearby",
-            "neighborhood": "neighborhood",
-            "school district": "school district",
-            
-            # Real estate terms
-            "pre approval": "pre-approval",
-            "preapproval": "pre-approval",
-            "pre qualify": "pre-qualify",
-            "prequalify": "pre-qualify",
-            "f h a": "FHA",
-            "fha": "FHA",
-            "v a": "VA",
-            "va loan": "VA loan",
-            "h o a": "HOA",
-            "hoa fees": "HOA fees",
-            "homeowners association": "homeowners association",
-            "condo": "condo",
-            "condominium": "condominium",
-            "townhouse": "townhouse",
-            "town home": "townhome",
-            "duplex": "duplex",
-            "triplex": "triplex",
-            "single family": "single-family",
-            "multi family": "multi-family",
-            "multifamily": "multi-family",
-            
-            # Financial terms
-            "down payment": "down payment",
-            "closing costs": "closing costs",
-            "escrow": "escrow",
-            "earnest money": "earnest money",
-            "interest rate": "interest rate",
-            "adjustable rate": "adjustable rate",
-            "fixed rate": "fixed rate",
-            "mortgage": "mortgage",
-            "loan": "loan",
-            "refinance": "refinance",
-            "refinancing": "refinancing",
-            "cash flow": "cash flow",
-            "net operating income": "net operating income",
-            "noi": "NOI",
-            "cap rate": "cap rate",
-            "capitalization rate": "capitalization rate",
-            "roi": "ROI",
-            "return on investment": "return on investment",
-            "cash on cash": "cash-on-cash",
-            "appreciation": "appreciation",
-            "equity": "equity",
-            "leverage": "leverage",
-        }
-        
-        # Phonetic alternatives for commonly misheard real estate terms
-        self.phonetic_alternatives = {
-            "reeltor": "realtor",
-            "reel estate": "real estate",
-            "reel a state": "real estate",
-            "morgage": "mortgage",
-            "morgidge": "mortgage",
-            "escroh": "escrow",
-            "iscrow": "escrow",
-            "contingensee": "contingency",
-            "preapruval": "pre-approval",
-            "howa": "HOA",
-            "h o way": "HOA",
-            "capperate": "cap rate",
-            "cash on cash": "cash-on-cash",
-            "eckwity": "equity",
-            "square foot-age": "square footage",
-            "square feet-age": "square footage"
-        }
+        self.speech_corrections = SPEECH_CORRECTIONS
+        self.phonetic_alternatives = PHONETIC_ALTERNATIVES
         
         # Create custom speech config with contextual phrases
         self._create_custom_speech_config()
@@ -240,29 +437,17 @@ class AzureServices:
         """Create custom speech config with contextual phrases for better recognition"""
         try:
             if self.speech_config:
-                # Add phrases to speech recognition to improve accuracy
-                phrase_list = speechsdk.PhraseListGrammar.from_recognizer(self.speech_recognizer)
-                
-                # Add common real estate terms to improve recognition
-                real_estate_terms = [
-                    "real estate", "realtor", "property", "mortgage", "interest rate",
-                    "down payment", "pre-approval", "escrow", "closing costs", "appraisal",
-                    "inspection", "contingencies", "HOA", "buyer's agent", "listing agent",
-                    "equity", "appreciation", "amortization", "capitalization rate",
-                    "cash flow", "investment property", "rental income", "fix and flip",
-                    "cash-on-cash return", "ROI", "property management", "refinance",
-                    "conventional loan", "FHA loan", "VA loan", "USDA loan", "jumbo loan",
-                    "seller's market", "buyer's market", "multiple listing service",
-                    "comparables", "days on market", "inventory", "pending sale"
-                ]
-                
-                # Add phrases to recognition context
-                for term in real_estate_terms:
-                    phrase_list.addPhrase(term)
-                
+                self._add_real_estate_phrases(self.speech_recognizer)
                 logger.info("Custom speech configuration created with real estate phrases")
         except Exception as e:
-            logger.error(f"Error creating custom speech config: {str(e)}")
+            logger.error("Error creating custom speech config: %s", e)
+    
+    @staticmethod
+    def _add_real_estate_phrases(recognizer):
+        """Bias a recognizer towards real estate terminology with a phrase list"""
+        phrase_list = speechsdk.PhraseListGrammar.from_recognizer(recognizer)
+        for term in REAL_ESTATE_PHRASES:
+            phrase_list.addPhrase(term)
     
     def _init_noise_reduction(self):
         """Initialize noise reduction and voice enhancement for better speech recognition"""
@@ -278,53 +463,53 @@ class AzureServices:
         
         logger.info("Noise reduction initialized with high suppression level")
     
-    def _process_recognized_speech(self, evt):
-        """Process recognized speech with context awareness and error correction"""
+    def _process_recognized_speech(self, result):
+        """Process a recognition result with context awareness and error correction"""
         try:
             # Get the recognized text
-            recognized_text = evt.result.text
+            recognized_text = result.text
             
             # Apply real estate terminology corrections
             corrected_text = self._apply_terminology_corrections(recognized_text)
             
             # Add to conversation history for context
-            self.conversation_history.append({
-                "role": "user",
-                "content": corrected_text
-            })
-            
-            # Trim history if needed
-            if len(self.conversation_history) > self.max_history_length * 2:  # *2 because each exchange has two entries
-                self.conversation_history = self.conversation_history[-self.max_history_length * 2:]
+            self._record_turn("user", corrected_text)
             
-            logger.debug(f"Processed speech: '{recognized_text}' -> '{corrected_text}'")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Processed speech: '%s' -> '%s'", recognized_text, corrected_text)
             return corrected_text
         except Exception as e:
-            logger.error(f"Error processing recognized speech: {str(e)}")
-            return evt.result.text if evt and hasattr(evt, 'result') and hasattr(evt.result, 'text') else ""
+            logger.error("Error processing recognized speech: %s", e)
+            return getattr(result, 'text', "") or ""
+    
+    def _normalize(self, text):
+        """Lowercase, strip punctuation and collapse whitespace once per query"""
+        return " ".join(text.lower().translate(PUNCTUATION_TABLE).split())
+    
+    def _record_turn(self, role, content):
+        """Append one message to the bounded conversation history"""
+        with self._history_lock:
+            self.conversation_history.append({"role": role, "content": content})
     
     def _apply_terminology_corrections(self, text):
         """Apply corrections to commonly misrecognized real estate terminology"""
         if not text:
             return text
         
-        # First correct phonetic alternatives
-        for wrong, correct in self.phonetic_alternatives.items():
-            text = re.sub(r'\b' + re.escape(wrong) + r'\b', correct, text, flags=re.IGNORECASE)
-        
-        # Then correct other common issues
-        for wrong, correct in self.speech_corrections.items():
-            text = re.sub(r'\b' + re.escape(wrong) + r'\b', correct, text, flags=re.IGNORECASE)
+        if CORRECTION_FIRST_TOKENS.isdisjoint(WORD_RE.findall(text.lower())):
+            return text
         
-        return text
+        # Single pass over the text using the merged correction table
+        return CORRECTION_RE.sub(lambda m: CORRECTION_MAP[m.group(1).lower()], text)
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-    async def process_query(self, query: str) -> str:
+    async def process_query(self, query: str, on_sentence: Optional[Callable[[str], Any]] = None) -> str:
         """
         Process a real estate query with retry logic and enhanced context awareness
         
         Args:
             query: The user's real estate query
+            on_sentence: Optional sink fed each sentence of the answer as it streams in
             
         Returns:
             A relevant response to the real estate query
@@ -337,8 +522,24 @@ class AzureServices:
             # Clean and standardize the query
             processed_query = self._apply_terminology_corrections(query)
             
+            # Normalize once and share it between intent detection and the cache key
+            normalized_query = self._normalize(processed_query)
+            
             # Detect intent for better response targeting
-            intent = self._detect_intent(processed_query)
+            intent = self._detect_intent(normalized_query)
+            
+            # Serve repeat questions from the answer cache
+            cache_key = None
+            if not TIME_SENSITIVE_RE.search(normalized_query):
+                cache_key = (intent, normalized_query)
+                cached = self._answer_cache.get(cache_key)
+                if cached is not None:
+                    logger.debug("Answer cache hit for intent %s", intent)
+                    if on_sentence is not None:
+                        for sentence in SENTENCE_END_RE.split(cached):
+                            on_sentence(sentence)
+                    self._record_turn("assistant", cached)
+                    return cached
             
             # Build conversation context
             messages = [
@@ -346,142 +547,135 @@ class AzureServices:
             ]
             
             # Add conversation history for context
-            for message in self.conversation_history[-6:]:  # Last 3 exchanges (6 messages)
-                messages.append(message)
+            with self._history_lock:
+                history = self.conversation_history
+                messages.extend(islice(history, max(0, len(history) - 6), None))  # Last 3 exchanges (6 messages)
             
             # Add the current query
             messages.append({"role": "user", "content": processed_query})
             
             # Get response from Azure OpenAI
-            response = await self._get_openai_response(messages)
+            response = await self._get_openai_response(messages, on_sentence)
+            if cache_key is not None and response:
+                self._answer_cache.set(cache_key, response)
             
             # Add response to conversation history
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": response
-            })
+            self._record_turn("assistant", response)
             
             return response
         except Exception as e:
-            logger.error(f"Error processing query: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error processing query: %s", e)
             return "I apologize, but I'm having trouble processing your question. Could you rephrase it or try asking something else about real estate?"
     
-    async def _get_openai_response(self, messages: List[Dict[str, str]]) -> str:
-        """Get response from OpenAI with proper async handling"""
-        try:
-            # Create a response with the OpenAI API
-            response = await asyncio.to_thread(
-                self.client.ChatCompletion.create,
-                engine=self.deployment_name,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=300,  # Keep responses concise for better conversation flow
-                top_p=0.95,
-                frequency_penalty=0.5,  # Reduce repetition
-                presence_penalty=0.2,
-                stop=None
-            )
+    async def _get_openai_response(self, messages: List[Dict[str, str]],
+                                   on_sentence: Optional[Callable[[str], Any]] = None) -> str:
+        """
+        Get response from OpenAI, streaming complete sentences to on_sentence as they arrive
+        
+        Args:
+            messages: Chat messages to send
+            on_sentence: Optional sink (e.g. a TTS speak call) fed each finished sentence
             
-            # Extract and return the response text
-            return response.choices[0].message['content'].strip()
+        Returns:
+            The full response text
+        """
+        try:
+            parts = []
+            pending = ""
+            async for fragment in self._stream_openai_response(messages):
+                parts.append(fragment)
+                if on_sentence is None:
+                    continue
+                # Hand off every finished sentence and keep the trailing partial one
+                pending += fragment
+                *sentences, pending = SENTENCE_END_RE.split(pending)
+                for sentence in sentences:
+                    on_sentence(sentence)
+            
+            if on_sentence is not None and pending.strip():
+                on_sentence(pending.strip())
+            return "".join(parts).strip()
         except Exception as e:
-            logger.error(f"Error getting OpenAI response: {str(e)}")
+            logger.error("Error getting OpenAI response: %s", e)
             raise
     
+    async def _stream_openai_response(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """Yield response text fragments from Azure OpenAI as they are generated"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        
+        def produce():
+            # The SDK stream is a blocking iterator, so drain it on a worker thread
+            try:
+                stream = self.client.ChatCompletion.create(
+                    api_key=self._get_bearer() if not self.api_key else self.api_key,
+                    engine=self.deployment_name,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=300,  # Keep responses concise for better conversation flow
+                    top_p=0.95,
+                    frequency_penalty=0.5,  # Reduce repetition
+                    presence_penalty=0.2,
+                    stop=None,
+                    stream=True
+                )
+                for chunk in stream:
+                    # Azure sends a leading chunk without choices for content filtering
+                    if chunk.choices:
+                        content = chunk.choices[0].delta.get("content")
+                        if content:
+                            loop.call_soon_threadsafe(queue.put_nowait, content)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        producer = loop.run_in_executor(self._azure_pool, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            await producer
+    
+    def _get_bearer(self) -> str:
+        """Return a managed identity token for Azure OpenAI, refreshing it shortly before expiry"""
+        with self._token_lock:
+            if self._token is None or time.time() >= self._token_expires_on - 60:
+                if self.credential is None:
+                    self.credential = DefaultAzureCredential()
+                token = self.credential.get_token("https://cognitiveservices.azure.com/.default")
+                self._token = token.token
+                self._token_expires_on = token.expires_on
+                # Keep the module-level key current for callers using the client directly
+                self.client.api_key = self._token
+            return self._token
+    
     def _detect_intent(self, query: str) -> str:
         """Detect the intent of a real estate query for better response targeting"""
-        query_lower = query.lower()
-        
-        # Check each intent category
-        for intent, keywords in self.real_estate_intents.items():
-            for keyword in keywords:
-                if keyword.lower() in query_lower:
-                    logger.debug(f"Detected intent: {intent} from query: {query}")
-                    return intent
+        match = INTENT_RE.match(query)
+        if match:
+            logger.debug("Detected intent: %s from query: %s", match.lastgroup, query)
+            return match.lastgroup
         
         # Default to general if no specific intent is found
         return "general"
     
     def _get_system_prompt(self, intent: str) -> str:
         """Get a tailored system prompt based on detected intent"""
-        base_prompt = """
-        You are a highly knowledgeable real estate assistant working for Premier Real Estate Services.
-        Your role is to provide accurate, helpful information about all aspects of real estate.
-        
-        When responding to queries:
-        1. ALWAYS provide specific, actionable information rather than vague statements
-        2. Use natural conversational language suitable for a phone call (use contractions, avoid overly formal language)
-        3. Break information into concise, digestible chunks
-        4. Limit responses to under 100 words when possible to maintain engagement
-        5. When discussing financial information, provide specific ranges and percentages when appropriate
-        6. Always acknowledge the question first before answering
-        7. End your response with a natural conversational transition or brief follow-up question
-        """
-        
-        # Add intent-specific guidance
-        intent_guidance = {
-            "buying": """
-            Focus on buyer-specific information. Emphasize the buying process, making offers,
-            negotiation strategies, financing options, and first-time homebuyer considerations.
-            Mention typical timelines (30-45 days for closing) and buyer closing costs (2-5%).
-            """,
-            
-            "selling": """
-            Focus on seller-specific information. Emphasize pricing strategies, marketing properties,
-            staging, negotiating offers, seller closing costs (6-10%), and typical timelines (60-90 days).
-            Discuss market conditions relevant to sellers and preparation for selling.
-            """,
-            
-            "investing": """
-            Focus on investment property information. Emphasize ROI calculations, cap rates (good range is 4-10%),
-            cash flow analysis, rental property management (costs typically 8-12% of rent),
-            and investment strategies (fix-and-flip, buy-and-hold, etc.).
-            """,
-            
-            "financing": """
-            Focus on mortgage and financing information. Emphasize loan types, down payment requirements,
-            interest rates, pre-approval process, closing costs, debt-to-income ratios (typically 43% max),
-            and credit score impacts (620+ for conventional, 580+ for FHA).
-            """,
-            
-            "market": """
-            Focus on market condition information. Emphasize current trends, supply and demand dynamics,
-            appreciation factors, seasonality impacts, inventory levels, and neighborhood analysis factors.
-            Discuss indicators of buyer's vs seller's markets.
-            """,
-            
-            "property": """
-            Focus on property-specific information. Emphasize property types, construction, home systems,
-            condition assessments, square footage considerations, lot size importance, and feature valuations.
-            Discuss how various features impact property value.
-            """,
-            
-            "process": """
-            Focus on real estate process information. Emphasize purchase contracts, contingencies,
-            escrow, closing process, title insurance, property disclosures, and real estate regulations.
-            Explain typical timelines and what to expect at each stage.
-            """,
-            
-            "location": """
-            Focus on location-specific information. Emphasize neighborhood evaluation, school districts
-            (10-20% premium for top districts), crime considerations, proximity to amenities,
-            transportation factors, future development impacts, and property tax variations.
-            """
-        }
-        
-        # Add intent-specific guidance if available
-        if intent in intent_guidance:
-            return base_prompt + "\n" + intent_guidance[intent]
-        else:
-            return base_prompt
+        return SYSTEM_PROMPTS.get(intent, BASE_SYSTEM_PROMPT)
     
     async def recognize_speech(self, audio_stream=None):
         """
         Enhanced speech recognition with advanced processing
         
         Args:
-            audio_stream: Optional audio stream for processing
+            audio_stream: Optional SDK audio stream, or a raw 16 kHz 16-bit mono PCM buffer
             
         Returns:
             The recognized text with real estate terminology corrections
@@ -491,17 +685,26 @@ class AzureServices:
                 logger.error("Speech recognizer not initialized")
                 return "Speech recognition not available"
             
-            # Start speech recognition
-            if audio_stream:
-                # Use provided audio stream
-                result = await asyncio.to_thread(
-                    self.speech_recognizer.recognize_once_async().get
-                )
-            else:
-                # Use microphone
-                result = await asyncio.to_thread(
-                    self.speech_recognizer.recognize_once_async().get
+            # Raw PCM is checked for speech locally before it is sent anywhere
+            if isinstance(audio_stream, (bytes, bytearray, memoryview)):
+                if not self._contains_speech(audio_stream):
+                    logger.debug("No voice activity in audio buffer, skipping recognition")
+                    return NO_SPEECH_MESSAGE
+                push_stream = speechsdk.audio.PushAudioInputStream()
+                push_stream.write(bytes(audio_stream))
+                push_stream.close()
+                audio_stream = push_stream
+            
+            # Recognize from the provided audio stream, or the default input otherwise
+            recognizer = self.speech_recognizer
+            if audio_stream is not None:
+                recognizer = speechsdk.SpeechRecognizer(
+                    speech_config=self.speech_config,
+                    audio_config=speechsdk.audio.AudioConfig(stream=audio_stream)
                 )
+                # Phrase lists belong to a recognizer, so this one needs its own
+                self._add_real_estate_phrases(recognizer)
+            result = await self._await_sdk_future(recognizer.recognize_once_async())
             
             if result.reason == speechsdk.ResultReason.RecognizedSpeech:
                 # Process and correct the recognized text
@@ -509,31 +712,75 @@ class AzureServices:
                 return processed_text
             elif result.reason == speechsdk.ResultReason.NoMatch:
                 logger.warning("No speech could be recognized")
-                return "I didn't hear that clearly. Could you repeat your question about real estate?"
+                return NO_SPEECH_MESSAGE
             elif result.reason == speechsdk.ResultReason.Canceled:
                 cancellation = speechsdk.CancellationDetails.from_result(result)
                 if cancellation.reason == speechsdk.CancellationReason.Error:
-                    logger.error(f"Speech recognition error: {cancellation.error_details}")
+                    logger.error("Speech recognition error: %s", cancellation.error_details)
                 return "I'm having trouble understanding you right now. Could you try again or maybe phrase your question differently?"
             else:
                 return "I didn't quite catch that. Could you repeat your question about real estate?"
         except Exception as e:
-            logger.error(f"Error in speech recognition: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in speech recognition: %s", e)
             return "I'm having technical difficulties understanding you. Please try again shortly."
     
-    def start_continuous_recognition(self, callback):
+    async def push_pcm(self, pcm16):
+        """
+        Feed 16 kHz 16-bit mono PCM to the recognizer no faster than real time
+        
+        Pushing audio ahead of real time overflows the service buffer and cancels
+        recognition, so each write waits until the audio already sent has elapsed.
+        """
+        # Without a speech key there is no recognizer to feed
+        if getattr(self, '_push_stream', None) is None:
+            logger.warning("Speech recognizer not initialized, dropping pushed audio")
+            return
+        
+        now = time.monotonic()
+        ahead = self._push_clock - now
+        if ahead > 0:
+            await asyncio.sleep(ahead)
+            now = time.monotonic()
+        self._push_clock = max(self._push_clock, now) + len(pcm16) / (PCM_SAMPLE_RATE * 2)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._azure_pool, self._push_stream.write, bytes(pcm16))
+    
+    def _contains_speech(self, pcm16, sample_rate=PCM_SAMPLE_RATE):
+        """Return True if any 30 ms frame of the PCM buffer contains voice activity"""
+        if self._vad is None:
+            return True
+        frame_size = int(sample_rate * 30 / 1000) * 2
+        pcm16 = bytes(pcm16)
+        return any(
+            self._vad.is_speech(pcm16[i:i + frame_size], sample_rate)
+            for i in range(0, len(pcm16) - frame_size + 1, frame_size)
+        )
+    
+    async def _await_sdk_future(self, sdk_future):
+        """Await a Speech SDK ResultFuture, which only exposes a blocking get()"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._azure_pool, sdk_future.get)
+    
+    def start_continuous_recognition(self, callback, partial_cb=None):
         """
         Start continuous speech recognition for more natural conversation
         
         Args:
             callback: Function to call with recognized speech results
+            partial_cb: Optional function to call with corrected interim results
         """
         try:
             if not self.speech_recognizer:
                 logger.error("Speech recognizer not initialized")
                 return False
             
+            self._partial_cb = partial_cb
+            
+            # Drop handlers from an earlier session so each utterance is processed once
+            self.speech_recognizer.recognized.disconnect_all()
+            self.speech_recognizer.session_stopped.disconnect_all()
+            self.speech_recognizer.canceled.disconnect_all()
+            
             # Set up callback for recognized speech
             self.speech_recognizer.recognized.connect(
                 lambda evt: self._handle_continuous_recognition(evt, callback)
@@ -546,7 +793,7 @@ class AzureServices:
             
             # Set up callback for canceled recognition
             self.speech_recognizer.canceled.connect(
-                lambda evt: logger.warning(f"Speech recognition canceled: {evt}")
+                lambda evt: logger.warning("Speech recognition canceled: %s", evt)
             )
             
             # Start continuous recognition
@@ -554,15 +801,25 @@ class AzureServices:
             logger.info("Continuous speech recognition started")
             return True
         except Exception as e:
-            logger.error(f"Error starting continuous recognition: {str(e)}")
+            logger.error("Error starting continuous recognition: %s", e)
             return False
     
+    def _on_partial(self, evt):
+        """Pass corrected interim text to the partial callback without touching history"""
+        partial_cb = self._partial_cb
+        if partial_cb is None:
+            return
+        try:
+            partial_cb(self._apply_terminology_corrections(evt.result.text))
+        except Exception as e:
+            logger.error("Error handling partial recognition: %s", e)
+    
     def _handle_continuous_recognition(self, evt, callback):
         """Handle recognized speech in continuous recognition mode"""
         try:
             if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
                 # Process recognized text
-                processed_text = self._process_recognized_speech(evt)
+                processed_text = self._process_recognized_speech(evt.result)
                 
                 # Call the callback with processed text
                 if callback and callable(callback):
@@ -571,7 +828,7 @@ class AzureServices:
                 logger.debug("No speech could be recognized in continuous mode")
             # Other reasons handled by the canceled callback
         except Exception as e:
-            logger.error(f"Error handling continuous recognition: {str(e)}")
+            logger.error("Error handling continuous recognition: %s", e)
     
     def stop_continuous_recognition(self):
         """Stop continuous speech recognition"""
@@ -582,7 +839,7 @@ class AzureServices:
                 return True
             return False
         except Exception as e:
-            logger.error(f"Error stopping continuous recognition: {str(e)}")
+            logger.error("Error stopping continuous recognition: %s", e)
             return False
     
     def enhance_audio_quality(self, audio_data):
@@ -618,13 +875,58 @@ class AzureServices:
         # We'll implement a simplified version that forwards to the OpenAI processing
         return await self.process_query(query)
 
+    def warmup(self):
+        """Open the Speech connection and send a one-token completion to pay TLS and model cold start"""
+        if getattr(self, '_connection', None):
+            try:
+                self._connection.open(True)
+                logger.info("Speech connection warmed up")
+            except Exception as e:
+                logger.warning("Speech warmup failed: %s", e)
+        
+        if self.client:
+            try:
+                self.client.ChatCompletion.create(
+                    api_key=self._get_bearer() if not self.api_key else self.api_key,
+                    engine=self.deployment_name,
+                    messages=[{"role": "user", "content": "hi"}],
+                    max_tokens=1
+                )
+                logger.info("Azure OpenAI connection warmed up")
+            except Exception as e:
+                logger.warning("Azure OpenAI warmup failed: %s", e)
+    
+    def start_warmup(self):
+        """Run warmup() in the background without delaying the caller"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            threading.Thread(target=self.warmup, daemon=True).start()
+        else:
+            loop.run_in_executor(self._azure_pool, self.warmup)
+    
     def shutdown(self):
         """Clean shutdown of services"""
         try:
             # Stop any ongoing recognition
             if hasattr(self, 'speech_recognizer') and self.speech_recognizer:
                 self.stop_continuous_recognition()
+            if getattr(self, '_push_stream', None):
+                self._push_stream.close()
+            if getattr(self, '_connection', None):
+                self._connection.close()
+            self._azure_pool.shutdown(wait=False, cancel_futures=True)
             
             logger.info("Azure services shutdown completed")
         except Exception as e:
-            logger.error(f"Error during shutdown: {str(e)}")
\ No newline at end of file
+            logger.error("Error during shutdown: %s", e)
+
+@lru_cache(maxsize=1)
+def get_azure_services() -> AzureServices:
+    """
+    Return the process-wide AzureServices instance, creating it on first use
+    
+    The instance owns the recognizer, connection and token cache, so callers share it
+    rather than constructing their own; call shutdown() on it only at process exit.
+    """
+    return AzureServices()
@@ -1,55 +1,231 @@
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from twilio.rest import Client
-import os
+from twilio.http.http_client import TwilioHttpClient
+from config import ENV, WEBHOOK_URL_OVERRIDES
+from semantic_cache import SemanticCache
 import logging
+import heapq
 import json
-import traceback
+import os
+import queue
 import re
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import count
 
-# Set up logging with more details for debugging
+# Set up logging; LOG_LEVEL=DEBUG adds per-webhook details for debugging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=ENV.get('LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 logger = logging.getLogger(__name__)
 
+# The knowledge base caches lookups by normalized query itself
+try:
+    from real_estate_knowledge_base import get_response as kb_lookup
+except ImportError:
+    kb_lookup = None
+
+# Finished calls are appended as JSON lines to one file, rotated once it grows past the limit
+HISTORY_FILE = ENV.get('HISTORY_FILE', 'conversation_history.jsonl')
+HISTORY_MAX_BYTES = int(ENV.get('HISTORY_MAX_BYTES', 64 * 1024 * 1024))
+
+# Prefer orjson for history records, fall back to the stdlib
+try:
+    import orjson
+
+    def dump_record(record):
+        return orjson.dumps(record) + b'\n'
+except ImportError:
+    def dump_record(record):
+        return json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+
+def is_current_history_file(history_file):
+    """Check that an open history file is still HISTORY_FILE and not a copy rotated away"""
+    # Every gunicorn worker appends to the same path, and any of them may rotate it
+    try:
+        current = os.stat(HISTORY_FILE)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(history_file.fileno())
+    return (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino)
+
+# Only the most recent turns of each call are kept in memory and sent to the model.
+# Histories are immutable tuples, replaced under the call's lock on every turn, so
+# readers can use whichever version they see without locking.
+CONVERSATION_HISTORY_TURNS = int(ENV.get('CONVERSATION_HISTORY_TURNS', 20))
+
+# Number of locks striped across active calls
+CALL_LOCK_STRIPES = 32
+
+# Opening and closing lines of every call
+GREETING_MESSAGE = (
+    "Hello, I'm calling from Premier Real Estate Services. "
+    "I'm an AI assistant here to answer your questions about "
+    "buying, selling, mortgages, market trends, or any other real estate topics. "
+    "How can I help you today?"
+)
+END_CALL_MESSAGE = (
+    "Thank you for calling Premier Real Estate Services. If you have more questions "
+    "in the future, feel free to call us again. Have a great day!"
+)
+
+# Prompts and stand-ins used on every answered turn
+ANOTHER_QUESTION_PROMPT = "Do you have another real estate question I can help with?"
+ANSWER_NO_INPUT_MESSAGE = "I didn't hear anything. Let me ask one more time."
+EMPTY_ANSWER_RESPONSE = (
+    "I understand you have a question about real estate. I'd be happy to help with "
+    "information about buying, selling, or investing in properties."
+)
+
+# Keywords and phrases that indicate the user wants to end the call
+END_CALL_PHRASES = (
+    'no', 'nope', 'no questions', 'no more questions', 'no other questions',
+    'no other question', "don't have any questions", "don't have any other questions",
+    "i don't have any questions", 'nothing else', 'that is all', "that's all",
+    'goodbye', 'bye', 'thank you goodbye', 'thanks goodbye', 'end call',
+    'hang up', 'that will be all', 'i am done', "i'm done", 'no thanks',
+    'gotta go', 'have to go', 'we re done', 'thats it', 'end this call',
+    'that concludes', 'thanks for your help', 'i am finished', 'i am good',
+    'that is enough', 'all set', 'i will let you go', 'good day', 'have a good day'
+)
+# Short replies are usually exactly one phrase, which a hash lookup settles
+END_CALL_PHRASE_SET = frozenset(END_CALL_PHRASES)
+# Otherwise substring match on any phrase, compiled once into a single alternation
+END_CALL_PHRASE_RE = re.compile('|'.join(re.escape(phrase) for phrase in END_CALL_PHRASES))
+
+# Callers who introduce themselves get answers addressed to them by name
+NAME_RE = re.compile(r"my name is (\w+)", re.IGNORECASE)
+
+# Sentences that indicate no further questions
+NO_QUESTION_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r"no,?\s+(i|I)?\s*(don'?t|do not)?\s*have\s*(any|more|other)?\s*questions",
+    r"(i|I)?\s*(don'?t|do not)\s*have\s*(any|more|other)?\s*questions",
+    r"that'?s\s+(all|it)",
+    r"nothing\s+(else|more)",
+    r"(i|I)'?m\s+(good|done|finished|all\s+set)",
+    r"(no|nope),?\s+(thank|thanks)\s+(you|ya)"
+))
+
+# Canned answers used when neither the knowledge base nor Azure can answer,
+# in priority order, each with the words that select it
+FALLBACK_TOPICS = (
+    (
+        ("buy", "buying", "buyer", "buyers", "purchase", "purchasing"),
+        "When buying a property, it's important to consider your budget, desired location, and long-term goals. I recommend getting pre-approved for a mortgage first to understand your budget. Our agents can help guide you through the entire process from property search to closing the deal. Would you like more specific information about any part of the home buying process?"
+    ),
+    (
+        ("sell", "selling", "seller", "sellers", "market", "list", "listing"),
+        "Selling a property involves preparing your home, determining the right price, marketing effectively, and negotiating offers. Our team can provide a comprehensive market analysis to determine the optimal listing price for your property. We also offer professional photography and marketing services to showcase your home at its best. Is there a specific aspect of selling you'd like to know more about?"
+    ),
+    (
+        ("mortgage", "mortgages", "loan", "loans", "finance", "financing", "interest", "down payment"),
+        "Real estate financing options include conventional mortgages, FHA loans, VA loans, and various first-time homebuyer programs. Current interest rates vary based on your credit score, loan amount, and down payment. I recommend speaking with a mortgage specialist to explore options tailored to your financial situation. Would you like me to explain any specific mortgage program in more detail?"
+    ),
+    (
+        ("invest", "investing", "investment", "investments", "investor", "rental", "rentals", "income", "property management"),
+        "Real estate investing can provide both income and appreciation. Common strategies include buying rental properties, fix-and-flip projects, or REITs for passive investment. The best approach depends on your financial goals, risk tolerance, and how hands-on you want to be. Our team works with many investors and can help you identify opportunities that match your investment criteria. What type of real estate investment are you considering?"
+    ),
+    (
+        ("market", "trend", "trends", "price", "prices", "value", "values", "appreciation"),
+        "Real estate markets are highly localized, with conditions varying by neighborhood. Generally, we're seeing moderate price growth with inventory levels improving in most areas. Interest rates remain a key factor affecting buyer demand. Our agents can provide you with detailed market analysis for specific areas you're interested in. Which location are you curious about?"
+    ),
+)
+FALLBACK_RESPONSES = tuple(response for _, response in FALLBACK_TOPICS)
+# Keyword -> index of the first topic listing it (built last to first so earlier topics win)
+FALLBACK_TOPIC_INDEX = {
+    keyword: index
+    for index, (keywords, _) in reversed(list(enumerate(FALLBACK_TOPICS)))
+    for keyword in keywords
+}
+FALLBACK_WORD_RE = re.compile(r"[a-z]+")
+DEFAULT_FALLBACK_RESPONSE = "I understand you have a question about real estate. At Premier Real Estate Services, we specialize in helping clients buy, sell, and invest in properties. Our experienced agents can provide guidance on property values, market trends, mortgage options, and investment strategies. Could you please provide more details about your specific real estate needs so I can give you more targeted information?"
+
+# Callers repeat the same questions, so remember the topic chosen for each query
+@lru_cache(maxsize=2048)
+def select_fallback_response(query_lower):
+    """Pick the canned answer for a lowercased query"""
+    # Look up each word and word pair of the query; the earliest topic wins
+    words = FALLBACK_WORD_RE.findall(query_lower)
+    terms = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+    topics = [FALLBACK_TOPIC_INDEX[term] for term in terms if term in FALLBACK_TOPIC_INDEX]
+    if topics:
+        return FALLBACK_RESPONSES[min(topics)]
+    
+    # General fallback for any real estate query
+    return DEFAULT_FALLBACK_RESPONSE
+
 class CallHandler:
     def __init__(self):
+        # Only fixed configuration is built here. With preload_app this runs in the
+        # gunicorn master, so clients, pools, locks and threads are created by
+        # start() in each serving process instead of crossing the fork.
+        self.twilio_phone_number = ENV.get('TWILIO_PHONE_NUMBER')
+        if not self.twilio_phone_number:
+            logger.warning("TWILIO_PHONE_NUMBER not set in environment variables")
+        
+        # Webhook URLs are fixed for the life of the process
+        self._base_url = ENV.get('SERVER_URL', 'http://localhost:5000')
+        self._speech_action = f"{self._base_url}/webhook/speech{WEBHOOK_URL_OVERRIDES}"
+        self._voice_redirect = f"{self._base_url}/webhook/voice{WEBHOOK_URL_OVERRIDES}"
+        
+        # Fixed responses are rendered once; only AI answers go through the TwiML builder
+        self._render_fixed_twiml()
+
+    def start(self, http_session=None):
+        """Create the clients, pools and background threads of this process"""
         # Initialize Twilio client with error handling
         try:
-            account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
-            auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
+            account_sid = ENV.get('TWILIO_ACCOUNT_SID')
+            auth_token = ENV.get('TWILIO_AUTH_TOKEN')
             
             if not account_sid or not auth_token:
                 logger.error("Missing Twilio credentials in environment variables")
                 self.client = None
             else:
-                self.client = Client(account_sid, auth_token)
+                http_client = TwilioHttpClient(pool_connections=True, timeout=10)
+                self.client = Client(account_sid, auth_token, http_client=http_client)
                 logger.info("Twilio client initialized successfully")
-                
-            self.twilio_phone_number = os.environ.get('TWILIO_PHONE_NUMBER')
-            if not self.twilio_phone_number:
-                logger.warning("TWILIO_PHONE_NUMBER not set in environment variables")
         except Exception as e:
-            logger.error(f"Error initializing Twilio client: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error initializing Twilio client: %s", e)
             self.client = None
         
         # Initialize Azure Services with retry
         self.initialize_azure_services(max_retries=3)
         
+        # Send Twilio and Azure OpenAI requests through the shared keep-alive pool
+        if http_session is not None:
+            self.set_http_session(http_session)
+        
+        # Bounded pool for outbound Twilio dials, sized to the HTTP connection pool
+        self._dial_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='twilio-dial')
+        
+        # Near-duplicate questions are answered from earlier responses when embeddings are available
+        self.semantic_cache = SemanticCache(
+            maxsize=int(ENV.get('SEMANTIC_CACHE_SIZE', 1024)),
+            threshold=float(ENV.get('SEMANTIC_CACHE_THRESHOLD', 0.9))
+        )
+        
         # Store active calls with their state and conversation history
         self.active_calls = {}
         
-        # Add threading lock for thread safety when accessing shared data
-        self.calls_lock = threading.Lock()
+        # Striped locks keyed by CallSid so webhooks for different calls don't contend
+        self._call_locks = [threading.Lock() for _ in range(CALL_LOCK_STRIPES)]
+        
+        # Min-heap of (last_activity, call_sid) so cleanup only visits expired calls;
+        # superseded entries stay in the heap and are skipped when popped
+        self._expiry_heap = []
+        self._heap_lock = threading.Lock()
         
         # Set up periodic cleanup for stale calls
         self._start_cleanup_thread()
         
+        # Finished calls are persisted by a background writer, off the webhook path
+        self._start_history_writer()
+        
         logger.info("CallHandler initialization completed")
 
     def initialize_azure_services(self, max_retries=3):
@@ -58,9 +234,9 @@ class CallHandler:
         while retries < max_retries:
             try:
                 # Import here to prevent errors if Azure modules aren't available
-                from azure_services import AzureServices
+                from azure_services import get_azure_services
                 
-                self.azure_services = AzureServices()
+                self.azure_services = get_azure_services()
                 self.use_azure = True
                 logger.info("Azure services initialized successfully")
                 return True
@@ -71,8 +247,7 @@ class CallHandler:
                 return False
             except Exception as e:
                 retries += 1
-                logger.error(f"Failed to initialize Azure services (attempt {retries}/{max_retries}): {str(e)}")
-                logger.error(traceback.format_exc())
+                logger.exception("Failed to initialize Azure services (attempt %s/%s): %s", retries, max_retries, e)
                 # Exponential backoff
                 time.sleep(2 ** retries)
         
@@ -82,6 +257,51 @@ class CallHandler:
         logger.error("All attempts to initialize Azure services failed")
         return False
 
+    def set_http_session(self, http_session):
+        """Route Twilio and Azure OpenAI requests through the given requests session"""
+        if self.client:
+            self.client.http_client.session = http_session
+        if self.use_azure and self.azure_services.client is not None:
+            self.azure_services.client.requestssession = http_session
+
+    def warmup(self):
+        """Open the pooled TLS connections to Twilio and Azure OpenAI and load the
+        embedding model before the first webhook"""
+        if self.client:
+            try:
+                self.client.api.v2010.accounts(self.client.account_sid).fetch()
+                logger.info("Twilio connection warmed up")
+            except Exception as e:
+                logger.warning("Twilio warmup failed: %s", e)
+        
+        # Azure cold start takes seconds, so let it finish in the background
+        if self.use_azure:
+            self.azure_services.start_warmup()
+        
+        # Load the embedding model in this worker before the first question needs it
+        try:
+            self.semantic_cache.load()
+        except Exception as e:
+            logger.warning("Semantic cache warmup failed: %s", e)
+
+    def _lock_for(self, call_sid):
+        """Return the lock guarding the state of the given call"""
+        return self._call_locks[hash(call_sid) % CALL_LOCK_STRIPES]
+
+    def _append_turns(self, call_data, *turns):
+        """Publish the call's history with the given turns added; hold the call's lock"""
+        history = (call_data['conversation_history'] + turns)[-CONVERSATION_HISTORY_TURNS:]
+        call_data['conversation_history'] = history
+        return history
+
+    def _mark_activity(self, call_sid):
+        """Schedule the call for expiry and return the new last_activity timestamp"""
+        # Monotonic, so clock adjustments can't expire live calls or keep dead ones
+        timestamp = time.monotonic()
+        with self._heap_lock:
+            heapq.heappush(self._expiry_heap, (timestamp, call_sid))
+        return timestamp
+
     def _start_cleanup_thread(self):
         """Start a background thread to clean up stale calls"""
         def cleanup_worker():
@@ -91,7 +311,7 @@ class CallHandler:
                     time.sleep(300)
                     self._cleanup_stale_calls()
                 except Exception as e:
-                    logger.error(f"Error in cleanup thread: {str(e)}")
+                    logger.error("Error in cleanup thread: %s", e)
         
         # Start the thread as daemon so it doesn't block program exit
         cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
@@ -100,26 +320,28 @@ class CallHandler:
 
     def _cleanup_stale_calls(self):
         """Remove calls that have been inactive for too long"""
-        current_time = time.time()
-        calls_to_remove = []
+        # Calls inactive for more than 30 minutes are removed
+        cutoff = time.monotonic() - 1800
+        expired = []
+        with self._heap_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] < cutoff:
+                expired.append(heapq.heappop(self._expiry_heap))
         
-        with self.calls_lock:
-            for call_sid, call_data in self.active_calls.items():
-                # Check if the call has a last_activity timestamp
-                if 'last_activity' in call_data:
-                    # If the call has been inactive for more than 30 minutes, mark it for removal
-                    if current_time - call_data['last_activity'] > 1800:  # 30 minutes
-                        calls_to_remove.append(call_sid)
-                else:
-                    # Add a timestamp if it doesn't exist
-                    self.active_calls[call_sid]['last_activity'] = current_time
-            
-            # Remove stale calls
-            for call_sid in calls_to_remove:
-                logger.info(f"Removing stale call {call_sid} due to inactivity")
-                self.active_calls.pop(call_sid, None)
+        removed = 0
+        for timestamp, call_sid in expired:
+            with self._lock_for(call_sid):
+                # Entries superseded by later activity no longer match the call's timestamp
+                call_data = self.active_calls.get(call_sid)
+                if call_data is not None and call_data.get('last_activity') == timestamp:
+                    logger.info("Removing stale call %s due to inactivity", call_sid)
+                    self.active_calls.pop(call_sid, None)
+                    removed += 1
         
-        logger.info(f"Cleanup completed. Removed {len(calls_to_remove)} stale calls.")
+        logger.info("Cleanup completed. Removed %s stale calls.", removed)
+
+    def submit_call(self, to_number):
+        """Dial on the Twilio pool and return a future resolving to initiate_call's result"""
+        return self._dial_executor.submit(self.initiate_call, to_number)
 
     def initiate_call(self, to_number):
         """Initiate a call to the provided phone number"""
@@ -133,7 +355,7 @@ class CallHandler:
                 }
                 
             # Your server URL where Twilio will send webhook requests
-            base_url = os.environ.get('SERVER_URL')
+            base_url = ENV.get('SERVER_URL')
             if not base_url:
                 logger.error("Cannot initiate call: SERVER_URL not set in environment variables")
                 return {
@@ -141,30 +363,30 @@ class CallHandler:
                     'error': 'SERVER_URL not configured'
                 }
                 
-            logger.info(f"Initiating call to {to_number} using base URL: {base_url}")
+            logger.info("Initiating call to %s using base URL: %s", to_number, base_url)
             
             # Make the call
             call = self.client.calls.create(
                 to=to_number,
                 from_=self.twilio_phone_number,
-                url=f"{base_url}/webhook/voice",
-                status_callback=f"{base_url}/webhook/status",
+                url=f"{base_url}/webhook/voice{WEBHOOK_URL_OVERRIDES}",
+                status_callback=f"{base_url}/webhook/status{WEBHOOK_URL_OVERRIDES}",
                 status_callback_event=['initiated', 'ringing', 'answered', 'completed'],
                 record=True,  # Enable call recording for quality monitoring
-                recording_status_callback=f"{base_url}/webhook/recording"
+                recording_status_callback=f"{base_url}/webhook/recording{WEBHOOK_URL_OVERRIDES}"
             )
             
             # Store call information with timestamp
-            with self.calls_lock:
+            with self._lock_for(call.sid):
                 self.active_calls[call.sid] = {
                     'to_number': to_number,
                     'status': 'initiated',
                     'conversation_state': 'greeting',
-                    'conversation_history': [],
-                    'last_activity': time.time()
+                    'conversation_history': (),
+                    'last_activity': self._mark_activity(call.sid)
                 }
             
-            logger.info(f"Call initiated successfully with SID: {call.sid}")
+            logger.info("Call initiated successfully with SID: %s", call.sid)
             return {
                 'success': True,
                 'message': 'Call initiated successfully',
@@ -172,400 +394,370 @@ class CallHandler:
             }
             
         except Exception as e:
-            logger.error(f"Error initiating call: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error initiating call: %s", e)
             return {
                 'success': False,
                 'error': str(e)
             }
 
-    def handle_incoming_call(self, form_data):
+    def handle_incoming_call(self, get_param):
         """Handle incoming call webhook from Twilio with improved speech recognition settings"""
         try:
-            response = VoiceResponse()
-            call_sid = form_data.get('CallSid')
-            logger.info(f"Handling incoming call with SID: {call_sid}")
+            call_sid = get_param('CallSid')
+            logger.info("Handling incoming call with SID: %s", call_sid)
             
             # Initialize or get call state
-            with self.calls_lock:
+            with self._lock_for(call_sid):
                 if call_sid not in self.active_calls:
-                    logger.info(f"New call detected, initializing state for call SID: {call_sid}")
+                    logger.info("New call detected, initializing state for call SID: %s", call_sid)
                     self.active_calls[call_sid] = {
                         'status': 'in-progress',
                         'conversation_state': 'greeting',
-                        'conversation_history': [],
-                        'last_activity': time.time()
+                        'conversation_history': (),
+                        'last_activity': self._mark_activity(call_sid)
                     }
                 else:
                     # Update the last activity timestamp
-                    self.active_calls[call_sid]['last_activity'] = time.time()
+                    self.active_calls[call_sid]['last_activity'] = self._mark_activity(call_sid)
                 
-                call_state = self.active_calls[call_sid].copy()  # Copy to avoid concurrent modification
-            
-            # Initial greeting
-            greeting_message = (
-                "Hello, I'm calling from Premier Real Estate Services. "
-                "I'm an AI assistant here to answer your questions about "
-                "buying, selling, mortgages, market trends, or any other real estate topics. "
-                "How can I help you today?"
-            )
+                # Read just the fields needed below instead of copying the whole record
+                call_data = self.active_calls[call_sid]
+                conversation_state = call_data['conversation_state']
+                needs_greeting = conversation_state == 'greeting' and not call_data['conversation_history']
             
             # Add greeting to conversation history if this is a new greeting
-            if call_state['conversation_state'] == 'greeting' and not call_state['conversation_history']:
-                with self.calls_lock:
-                    self.active_calls[call_sid]['conversation_history'].append({
+            if needs_greeting:
+                with self._lock_for(call_sid):
+                    self._append_turns(self.active_calls[call_sid], {
                         "role": "assistant", 
-                        "content": greeting_message
+                        "content": GREETING_MESSAGE
                     })
-                
-                # Speak slowly and clearly for better comprehension
-                response.say(
-                    greeting_message, 
-                    voice='alice',
-                    rate="0.9"  # Slightly slower pace for clarity
-                )
                 logger.info("Delivered greeting message")
-            
-            # Set up gather for speech input with improved settings
-            base_url = os.environ.get('SERVER_URL', 'http://localhost:5000')
-            gather = Gather(
-                input='speech',
-                action=f"{base_url}/webhook/speech",
-                timeout=7,  # Increased timeout for user to start speaking
-                speechTimeout='auto',
-                enhanced=True,
-                language='en-US',
-                speechModel='phone_call',
-                profanityFilter=False,  # Allow natural speech including words AI might flag
-            )
-            
-            # Add prompt based on conversation state
-            if call_state['conversation_state'] == 'greeting':
-                gather.say("Please go ahead with your question.", voice='alice', rate="0.9")
+                twiml = self._greeting_twiml
+            # Prompt based on conversation state
+            elif conversation_state == 'greeting':
+                twiml = self._first_question_twiml
             else:
-                gather.say("Do you have another real estate question I can help with?", voice='alice', rate="0.9")
-            
-            response.append(gather)
-            
-            # Add fallback in case no input is received
-            response.say(
-                "I didn't hear anything. Please speak clearly when you're ready.", 
-                voice='alice',
-                rate="0.9"
-            )
-            response.redirect(f"{base_url}/webhook/voice")
+                twiml = self._next_question_twiml
             
-            logger.debug(f"TwiML response for incoming call: {str(response)}")
-            return str(response)
+            logger.debug("TwiML response for incoming call: %s", twiml)
+            return twiml
             
         except Exception as e:
-            logger.error(f"Error handling incoming call: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error handling incoming call: %s", e)
             # Return a valid TwiML response even in case of error
-            error_response = VoiceResponse()
-            error_response.say(
-                "I'm sorry, we're experiencing technical difficulties. Please try again later.", 
-                voice='alice',
-                rate="0.9"
-            )
-            error_response.hangup()
-            return str(error_response)
+            return self._incoming_error_twiml
 
-    def handle_call_status(self, form_data):
+    def handle_call_status(self, get_param):
         """Handle call status updates from Twilio"""
         try:
-            call_sid = form_data.get('CallSid')
-            call_status = form_data.get('CallStatus')
-            logger.info(f"Call status update for SID {call_sid}: {call_status}")
+            call_sid = get_param('CallSid')
+            call_status = get_param('CallStatus')
+            logger.info("Call status update for SID %s: %s", call_sid, call_status)
             
-            with self.calls_lock:
+            finished_call = None
+            with self._lock_for(call_sid):
                 if call_sid in self.active_calls:
                     self.active_calls[call_sid]['status'] = call_status
-                    self.active_calls[call_sid]['last_activity'] = time.time()
+                    self.active_calls[call_sid]['last_activity'] = self._mark_activity(call_sid)
                     
                     # Clean up completed calls
                     if call_status in ['completed', 'failed', 'busy', 'no-answer', 'canceled']:
-                        # Log the conversation history before removing it
-                        if 'conversation_history' in self.active_calls[call_sid]:
-                            try:
-                                # Store the conversation history for analytics
-                                self._store_conversation_history(call_sid, self.active_calls[call_sid])
-                                logger.info(f"Call {call_sid} completed. Conversation history stored.")
-                            except Exception as e:
-                                logger.error(f"Error storing conversation history: {str(e)}")
-                                
-                        self.active_calls.pop(call_sid, None)
+                        finished_call = self.active_calls.pop(call_sid, None)
+            
+            # Store the conversation history for analytics without holding the lock
+            # or delaying the webhook response on disk I/O
+            if finished_call and 'conversation_history' in finished_call:
+                self._store_conversation_history(call_sid, finished_call)
+                logger.info("Call %s completed. Conversation history queued.", call_sid)
                     
             return {'success': True}
         except Exception as e:
-            logger.error(f"Error handling call status: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error handling call status: %s", e)
             return {'success': False, 'error': str(e)}
 
+    def _start_history_writer(self):
+        """Start a background thread that appends finished calls to the history file"""
+        self._persist_q = queue.Queue()
+        writer_thread = threading.Thread(target=self._history_writer, args=(self._persist_q,), daemon=True)
+        writer_thread.start()
+        logger.info("Started conversation history writer")
+
+    def _history_writer(self, persist_q):
+        """Drain queued records into the history file, one flush per batch"""
+        history_file = None
+        rotations = count()
+        while True:
+            records = [persist_q.get()]
+            # Anything queued meanwhile goes out in the same write
+            while True:
+                try:
+                    records.append(persist_q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if history_file is not None and not is_current_history_file(history_file):
+                    history_file.close()
+                    history_file = None
+                if history_file is None:
+                    history_file = open(HISTORY_FILE, 'ab')
+                history_file.write(b''.join(dump_record(record) for record in records))
+                history_file.flush()
+                logger.info("Stored conversation history for %s call(s)", len(records))
+                
+                if history_file.tell() >= HISTORY_MAX_BYTES:
+                    # Skip the rename if another worker rotated the file first; the pid
+                    # and rotation count keep every rotated name distinct
+                    rotate = is_current_history_file(history_file)
+                    history_file.close()
+                    history_file = None
+                    if rotate:
+                        os.replace(HISTORY_FILE, f"{HISTORY_FILE}.{time.strftime('%Y%m%d-%H%M%S')}.{os.getpid()}.{next(rotations)}")
+            except Exception as e:
+                logger.error("Failed to store conversation history: %s", e)
+                # Reopen on the next batch in case the file went away
+                if history_file is not None:
+                    history_file.close()
+                    history_file = None
+
     def _store_conversation_history(self, call_sid, call_data):
-        """Store conversation history for analytics and training"""
-        try:
-            # In a production system, you would store this in a database
-            # For now, we'll just log it
-            history_file = f"conversation_history_{call_sid}.json"
-            with open(history_file, 'w') as f:
-                json.dump(call_data, f, indent=2)
-            logger.info(f"Saved conversation history to {history_file}")
-            
-            # In a real implementation, you would use a database like:
-            # - MongoDB for flexible document storage
-            # - PostgreSQL with JSONB for structured and queryable storage
-            # - Cloud-based solutions like Azure CosmosDB or AWS DynamoDB
-            
-        except Exception as e:
-            logger.error(f"Failed to store conversation history: {str(e)}")
-            raise
+        """Queue conversation history for analytics and training"""
+        # In a production system, you would store this in a database like:
+        # - MongoDB for flexible document storage
+        # - PostgreSQL with JSONB for structured and queryable storage
+        # - Cloud-based solutions like Azure CosmosDB or AWS DynamoDB
+        self._persist_q.put_nowait({'sid': call_sid, 'stored_at': time.time(), 'data': call_data})
 
     def is_end_of_call(self, speech_text):
         """Check if user wants to end the call with improved pattern matching"""
         # Normalized input for better matching
         normalized_text = speech_text.lower().strip()
         
-        # Keywords and phrases that indicate the user wants to end the call
-        end_call_phrases = [
-            'no', 'nope', 'no questions', 'no more questions', 'no other questions',
-            'no other question', "don't have any questions", "don't have any other questions",
-            "i don't have any questions", 'nothing else', 'that is all', "that's all",
-            'goodbye', 'bye', 'thank you goodbye', 'thanks goodbye', 'end call',
-            'hang up', 'that will be all', 'i am done', "i'm done", 'no thanks',
-            'gotta go', 'have to go', 'we re done', 'thats it', 'end this call',
-            'that concludes', 'thanks for your help', 'i am finished', 'i am good',
-            'that is enough', 'all set', 'i will let you go', 'good day', 'have a good day'
-        ]
-        
-        # Check if the normalized text matches or contains any end call phrases
-        for phrase in end_call_phrases:
-            if phrase == normalized_text or phrase in normalized_text:
-                return True
+        # Check for an exact end call phrase, then for one anywhere in the text
+        if normalized_text in END_CALL_PHRASE_SET or END_CALL_PHRASE_RE.search(normalized_text):
+            return True
             
         # Check for sentences that indicate no further questions
-        no_question_patterns = [
-            r"no,?\s+(i|I)?\s*(don'?t|do not)?\s*have\s*(any|more|other)?\s*questions",
-            r"(i|I)?\s*(don'?t|do not)\s*have\s*(any|more|other)?\s*questions",
-            r"that'?s\s+(all|it)",
-            r"nothing\s+(else|more)",
-            r"(i|I)'?m\s+(good|done|finished|all\s+set)",
-            r"(no|nope),?\s+(thank|thanks)\s+(you|ya)"
-        ]
-        
-        for pattern in no_question_patterns:
-            if re.search(pattern, normalized_text):
+        for pattern in NO_QUESTION_PATTERNS:
+            if pattern.search(normalized_text):
                 return True
                 
         return False
 
-    def handle_speech_input(self, form_data):
+    def handle_speech_input(self, get_param):
         """Process speech input from the call with improved handling"""
         try:
-            response = VoiceResponse()
-            call_sid = form_data.get('CallSid')
-            speech_result = form_data.get('SpeechResult')
-            confidence = form_data.get('Confidence', 0)
+            call_sid = get_param('CallSid')
+            speech_result = get_param('SpeechResult')
+            confidence = get_param('Confidence', 0)
             
             # Log incoming speech data
-            logger.debug(f"Speech result: '{speech_result}', Confidence: {confidence}")
-            logger.debug(f"All form data: {form_data}")
+            logger.debug("Speech result: '%s', Confidence: %s", speech_result, confidence)
             
             # Make sure we have an active call record
-            with self.calls_lock:
+            with self._lock_for(call_sid):
                 if call_sid not in self.active_calls:
-                    logger.warning(f"Received speech for unknown call SID: {call_sid} - initializing new call record")
+                    logger.warning("Received speech for unknown call SID: %s - initializing new call record", call_sid)
                     self.active_calls[call_sid] = {
                         'status': 'in-progress',
                         'conversation_state': 'in-progress',
-                        'conversation_history': [],
-                        'last_activity': time.time()
+                        'conversation_history': (),
+                        'last_activity': self._mark_activity(call_sid)
                     }
                 else:
                     # Update activity timestamp
-                    self.active_calls[call_sid]['last_activity'] = time.time()
+                    self.active_calls[call_sid]['last_activity'] = self._mark_activity(call_sid)
                 
-                # Get a copy to avoid concurrent modification issues
-                call_state = self.active_calls[call_sid].copy()
             
             # Handle low confidence or empty speech
             if not speech_result or float(confidence or 0) < 0.3:
-                logger.warning(f"Low confidence speech detected: {confidence}")
-                response.say(
-                    "I'm sorry, I didn't catch that clearly. Could you please speak a bit louder and more clearly?", 
-                    voice='alice',
-                    rate="0.9"
-                )
-                
-                # Set up a new gather for retry
-                base_url = os.environ.get('SERVER_URL', 'http://localhost:5000')
-                gather = Gather(
-                    input='speech',
-                    action=f"{base_url}/webhook/speech",
-                    timeout=7,
-                    speechTimeout='auto',
-                    enhanced=True,
-                    language='en-US',
-                    speechModel='phone_call',
-                    profanityFilter=False
-                )
-                gather.say("Please ask your real estate question clearly.", voice='alice', rate="0.9")
-                response.append(gather)
-                
-                # Add fallback if no input received
-                response.say("I still didn't hear anything. Let me ask again.", voice='alice', rate="0.9")
-                response.redirect(f"{base_url}/webhook/voice")
-                
-                return str(response)
+                logger.warning("Low confidence speech detected: %s", confidence)
+                return self._low_confidence_twiml
             
-            logger.info(f"Recognized speech: {speech_result}")
+            logger.info("Recognized speech: %s", speech_result)
             
             # Check if user wants to end the call
             if self.is_end_of_call(speech_result):
                 logger.info("User indicated end of call")
-                end_message = "Thank you for calling Premier Real Estate Services. If you have more questions in the future, feel free to call us again. Have a great day!"
-                response.say(end_message, voice='alice', rate="0.9")
-                response.hangup()
                 
                 # Add the final user and system messages to conversation history
-                with self.calls_lock:
-                    self.active_calls[call_sid]['conversation_history'].append({
+                with self._lock_for(call_sid):
+                    self._append_turns(self.active_calls[call_sid], {
                         "role": "user",
                         "content": speech_result
-                    })
-                    self.active_calls[call_sid]['conversation_history'].append({
+                    }, {
                         "role": "assistant",
-                        "content": end_message
+                        "content": END_CALL_MESSAGE
                     })
                 
-                return str(response)
-            
-            # Add user query to conversation history
-            with self.calls_lock:
-                self.active_calls[call_sid]['conversation_history'].append({
+                return self._end_call_twiml
+            
+            # Add user query to conversation history, remembering the caller's name
+            # the first time they give it
+            name_match = NAME_RE.search(speech_result)
+            with self._lock_for(call_sid):
+                call_data = self.active_calls[call_sid]
+                conversation_history = self._append_turns(call_data, {
                     "role": "user",
                     "content": speech_result
                 })
+                if name_match and 'user_name' not in call_data:
+                    call_data['user_name'] = name_match.group(1).capitalize()
+                user_name = call_data.get('user_name')
             
             # Try to address the query with multiple fallback mechanisms
-            ai_response = self._process_user_query(speech_result, call_state.get('conversation_history', []))
+            ai_response = self._process_user_query(speech_result, conversation_history, user_name)
             
-            logger.info(f"Final AI Response: {ai_response}")
+            logger.info("Final AI Response: %s", ai_response)
             
             # Add assistant response to conversation history
-            with self.calls_lock:
-                self.active_calls[call_sid]['conversation_history'].append({
+            with self._lock_for(call_sid):
+                self._append_turns(self.active_calls[call_sid], {
                     "role": "assistant",
                     "content": ai_response
                 })
                 
             # Check if response is valid before adding to TwiML
             if not ai_response or not isinstance(ai_response, str) or len(ai_response.strip()) == 0:
-                ai_response = "I understand you have a question about real estate. I'd be happy to help with information about buying, selling, or investing in properties."
+                ai_response = EMPTY_ANSWER_RESPONSE
             
             # Respond to the user with the answer - limit to 1000 chars to avoid TwiML issues
             if len(ai_response) > 1000:
                 ai_response = ai_response[:997] + "..."
                 
-            # Break long responses into smaller chunks for better comprehension
-            response_chunks = self._chunk_response(ai_response)
-            for chunk in response_chunks:
-                response.say(chunk, voice='alice', rate="0.9")
+            response = VoiceResponse()
+            
+            # Speak the whole answer in one <Say> so Twilio synthesizes it in a single pass;
+            # the chunks only ever split on whitespace, so joining them is the text itself
+            response.say(ai_response, voice='alice', rate="0.9")
             
             # Ask if they have another question with a new Gather
-            base_url = os.environ.get('SERVER_URL', 'http://localhost:5000')
-            gather = Gather(
-                input='speech',
-                action=f"{base_url}/webhook/speech",
-                timeout=7,
-                speechTimeout='auto',
-                enhanced=True,
-                language='en-US',
-                speechModel='phone_call',
-                profanityFilter=False
-            )
-            gather.say("Do you have another real estate question I can help with?", voice='alice', rate="0.9")
-            response.append(gather)
+            response.append(self._make_gather(ANOTHER_QUESTION_PROMPT))
             
             # Add a fallback if no response is received
-            response.say("I didn't hear anything. Let me ask one more time.", voice='alice', rate="0.9")
-            response.redirect(f"{base_url}/webhook/voice")
+            response.say(ANSWER_NO_INPUT_MESSAGE, voice='alice', rate="0.9")
+            response.redirect(self._voice_redirect)
             
             # Update call state
-            with self.calls_lock:
+            with self._lock_for(call_sid):
                 self.active_calls[call_sid]['conversation_state'] = 'in-progress'
             
-            logger.debug(f"TwiML response for speech input: {str(response)}")
+            logger.debug("TwiML response for speech input: %s", response)
             return str(response)
             
         except Exception as e:
-            logger.error(f"Error handling speech input: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error handling speech input: %s", e)
             
             # Return a valid TwiML response even in case of error
-            error_response = VoiceResponse()
-            error_response.say(
-                "I'm sorry, we're experiencing technical difficulties. Please try again.", 
+            return self._speech_error_twiml
+
+    def _render_fixed_twiml(self):
+        """Pre-render the TwiML documents whose content never changes"""
+        # Incoming call: optional greeting, a Gather, and a redirect if nothing is heard
+        def incoming_call(greeting, prompt):
+            response = VoiceResponse()
+            if greeting:
+                # Speak slowly and clearly for better comprehension
+                response.say(greeting, voice='alice', rate="0.9")
+            response.append(self._make_gather(prompt))
+            response.say(
+                "I didn't hear anything. Please speak clearly when you're ready.", 
                 voice='alice',
                 rate="0.9"
             )
-            
-            # Set up a new gather for retry
-            base_url = os.environ.get('SERVER_URL', 'http://localhost:5000')
-            gather = Gather(
-                input='speech',
-                action=f"{base_url}/webhook/speech",
-                timeout=7,
-                speechTimeout='auto'
-            )
-            gather.say("Please ask your question again.", voice='alice', rate="0.9")
-            error_response.append(gather)
-            
-            return str(error_response)
-
-    def _chunk_response(self, response_text, max_chunk_length=150):
-        """Break long responses into smaller chunks at natural break points"""
-        if len(response_text) <= max_chunk_length:
-            return [response_text]
-            
-        # Find natural break points (sentences)
-        chunks = []
-        current_chunk = ""
+            response.redirect(self._voice_redirect)
+            return str(response)
         
-        # Split by sentences
-        sentences = re.split(r'(?<=[.!?])\s+', response_text)
+        self._greeting_twiml = incoming_call(GREETING_MESSAGE, "Please go ahead with your question.")
+        self._first_question_twiml = incoming_call(None, "Please go ahead with your question.")
+        self._next_question_twiml = incoming_call(None, ANOTHER_QUESTION_PROMPT)
         
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) <= max_chunk_length:
-                current_chunk += " " + sentence if current_chunk else sentence
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence
-                
-        # Add the last chunk if there's anything left
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-            
-        return chunks
+        response = VoiceResponse()
+        response.say(
+            "I'm sorry, we're experiencing technical difficulties. Please try again later.", 
+            voice='alice',
+            rate="0.9"
+        )
+        response.hangup()
+        self._incoming_error_twiml = str(response)
+        
+        # Low confidence or empty speech: ask again with a new Gather
+        response = VoiceResponse()
+        response.say(
+            "I'm sorry, I didn't catch that clearly. Could you please speak a bit louder and more clearly?", 
+            voice='alice',
+            rate="0.9"
+        )
+        response.append(self._make_gather("Please ask your real estate question clearly."))
+        response.say("I still didn't hear anything. Let me ask again.", voice='alice', rate="0.9")
+        response.redirect(self._voice_redirect)
+        self._low_confidence_twiml = str(response)
+        
+        response = VoiceResponse()
+        response.say(END_CALL_MESSAGE, voice='alice', rate="0.9")
+        response.hangup()
+        self._end_call_twiml = str(response)
+        
+        response = VoiceResponse()
+        response.say(
+            "I'm sorry, we're experiencing technical difficulties. Please try again.", 
+            voice='alice',
+            rate="0.9"
+        )
+        response.append(self._make_gather("Please ask your question again."))
+        self._speech_error_twiml = str(response)
+
+    def _make_gather(self, prompt):
+        """Build the standard speech Gather used after every prompt"""
+        gather = Gather(
+            input='speech',
+            action=self._speech_action,
+            timeout=7,  # Increased timeout for user to start speaking
+            speechTimeout='auto',
+            enhanced=True,
+            language='en-US',
+            speechModel='phone_call',
+            profanityFilter=False,  # Allow natural speech including words AI might flag
+        )
+        gather.say(prompt, voice='alice', rate="0.9")
+        return gather
 
-    def _process_user_query(self, query, conversation_history):
+    def _process_user_query(self, query, conversation_history, user_name=None):
         """Process user query with multiple fallback mechanisms"""
+        # The KB and keyword fallback both match on the lowercased query
+        query_lower = query.lower().strip()
+        
+        # Answer near-duplicates of earlier questions without touching the KB or Azure
+        query_vector = None
+        try:
+            query_vector, cached = self.semantic_cache.lookup(query)
+            if cached is not None:
+                logger.info("Response found in semantic cache")
+                answer, from_kb = cached
+                # Cached KB answers are stored unpersonalized, so enhance for this caller
+                if from_kb:
+                    return self._enhance_kb_response(answer, user_name)
+                return answer
+        except Exception as e:
+            logger.error("Error using semantic cache: %s", e)
+        
         # First try local knowledge base
         try:
-            from real_estate_knowledge_base import get_response
-            kb_response, found_in_kb = get_response(query)
+            if kb_lookup is None:
+                raise ImportError("real_estate_knowledge_base")
+            kb_response, found_in_kb = kb_lookup(query_lower)
             
             if found_in_kb and kb_response:
                 logger.info("Response found in knowledge base")
+                self.semantic_cache.store(query_vector, (kb_response, True))
                 # Enhance the KB response with context awareness if needed
-                enhanced_response = self._enhance_kb_response(kb_response, query, conversation_history)
+                enhanced_response = self._enhance_kb_response(kb_response, user_name)
                 return enhanced_response
         except ImportError:
             logger.warning("Could not import real_estate_knowledge_base module")
             found_in_kb = False
         except Exception as e:
-            logger.error(f"Error using knowledge base: {str(e)}")
+            logger.error("Error using knowledge base: %s", e)
             found_in_kb = False
             
         # If not found in knowledge base, try Azure OpenAI
@@ -575,64 +767,36 @@ class CallHandler:
                 
                 if azure_response and isinstance(azure_response, str) and len(azure_response.strip()) > 0:
                     logger.info("Successfully got response from Azure OpenAI")
+                    self.semantic_cache.store(query_vector, (azure_response, False))
                     return azure_response
         except Exception as e:
-            logger.error(f"Error using Azure OpenAI: {str(e)}")
+            logger.error("Error using Azure OpenAI: %s", e)
             
         # Final fallback - use comprehensive real estate response
         logger.info("All AI methods failed, using comprehensive fallback")
-        return self._generate_comprehensive_fallback(query)
+        return self._generate_comprehensive_fallback(query_lower)
         
-    def _enhance_kb_response(self, kb_response, query, conversation_history):
+    def _enhance_kb_response(self, kb_response, user_name=None):
         """Enhance knowledge base response with context awareness"""
         # This method could be expanded to use the conversation history
         # to make the knowledge base responses more contextual
         
         # For now, we'll make simple enhancements
         
-        # Add personalization if appropriate
-        if len(conversation_history) >= 2:
-            # Get the first user message to check if they've mentioned their name
-            for message in conversation_history:
-                if message.get("role") == "user":
-                    user_message = message.get("content", "").lower()
-                    name_match = re.search(r"my name is (\w+)", user_message)
-                    if name_match:
-                        name = name_match.group(1).capitalize()
-                        # Add personalization to the response
-                        kb_response = f"{name}, {kb_response}"
-                        break
+        # Add personalization if the caller has told us their name
+        if user_name:
+            kb_response = f"{user_name}, {kb_response}"
         
         return kb_response
         
-    def _generate_comprehensive_fallback(self, query):
-        """Generate a comprehensive fallback response based on the query"""
-        # Extract key topics from the query
-        query_lower = query.lower()
-        
-        # Check for common real estate topics
-        if any(word in query_lower for word in ["buy", "buying", "purchase", "purchasing"]):
-            return "When buying a property, it's important to consider your budget, desired location, and long-term goals. I recommend getting pre-approved for a mortgage first to understand your budget. Our agents can help guide you through the entire process from property search to closing the deal. Would you like more specific information about any part of the home buying process?"
-            
-        elif any(word in query_lower for word in ["sell", "selling", "market", "list"]):
-            return "Selling a property involves preparing your home, determining the right price, marketing effectively, and negotiating offers. Our team can provide a comprehensive market analysis to determine the optimal listing price for your property. We also offer professional photography and marketing services to showcase your home at its best. Is there a specific aspect of selling you'd like to know more about?"
-            
-        elif any(word in query_lower for word in ["mortgage", "loan", "finance", "interest", "down payment"]):
-            return "Real estate financing options include conventional mortgages, FHA loans, VA loans, and various first-time homebuyer programs. Current interest rates vary based on your credit score, loan amount, and down payment. I recommend speaking with a mortgage specialist to explore options tailored to your financial situation. Would you like me to explain any specific mortgage program in more detail?"
-            
-        elif any(word in query_lower for word in ["invest", "investment", "rental", "income", "property management"]):
-            return "Real estate investing can provide both income and appreciation. Common strategies include buying rental properties, fix-and-flip projects, or REITs for passive investment. The best approach depends on your financial goals, risk tolerance, and how hands-on you want to be. Our team works with many investors and can help you identify opportunities that match your investment criteria. What type of real estate investment are you considering?"
-            
-        elif any(word in query_lower for word in ["market", "trend", "price", "value", "appreciation"]):
-            return "Real estate markets are highly localized, with conditions varying by neighborhood. Generally, we're seeing moderate price growth with inventory levels improving in most areas. Interest rates remain a key factor affecting buyer demand. Our agents can provide you with detailed market analysis for specific areas you're interested in. Which location are you curious about?"
-            
-        else:
-            # General fallback for any real estate query
-            return "I understand you have a question about real estate. At Premier Real Estate Services, we specialize in helping clients buy, sell, and invest in properties. Our experienced agents can provide guidance on property values, market trends, mortgage options, and investment strategies. Could you please provide more details about your specific real estate needs so I can give you more targeted information?"
+    def _generate_comprehensive_fallback(self, query_lower):
+        """Generate a comprehensive fallback response based on the lowercased query"""
+        return select_fallback_response(query_lower)
 
     def get_call_history(self, call_sid):
-        """Get conversation history for a specific call"""
-        with self.calls_lock:
-            if call_sid in self.active_calls and 'conversation_history' in self.active_calls[call_sid]:
-                return self.active_calls[call_sid]['conversation_history']
-        return []
\ No newline at end of file
+        """Get conversation history for a specific call as an immutable snapshot"""
+        # No lock or copy needed: the history tuple is never mutated, only replaced
+        call_data = self.active_calls.get(call_sid)
+        if call_data is None:
+            return ()
+        return call_data.get('conversation_history', ())
\ No newline at end of file
@@ -0,0 +1,30 @@
+from dotenv import dotenv_values
+from functools import lru_cache
+from types import MappingProxyType
+import os
+
+@lru_cache(maxsize=1)
+def env():
+    """Parse .env once per process and return a read-only view of the configuration"""
+    # Process environment wins over .env, same precedence as load_dotenv()
+    for key, value in dotenv_values().items():
+        if value is not None:
+            os.environ.setdefault(key, value)
+    return MappingProxyType(dict(os.environ))
+
+ENV = env()
+
+def get_env(key, default=None):
+    """Look up a configuration value from the cached environment"""
+    return ENV.get(key, default)
+
+# Twilio connection overrides appended to webhook URLs, after any query string.
+# Twilio strips the fragment before requesting and signing the URL.
+#
+# Speech, voice and status webhooks fail over after 2s to connect, retry connect
+# failures twice, and give up on the whole request after 15s; the read timeout
+# leaves room for a model answer on /webhook/speech.
+WEBHOOK_URL_OVERRIDES = ENV.get('TWILIO_CONNECTION_OVERRIDES', '#ct=2000&rt=10000&rc=2&tt=15000')
+# The interrupt handler does no model work, so Twilio fails over from a stalled
+# worker much sooner
+INTERRUPT_URL_OVERRIDES = ENV.get('TWILIO_INTERRUPT_OVERRIDES', '#ct=500&rt=3000&rc=1')
@@ -1,11 +1,62 @@
-import os
 import logging
-import json
+import heapq
 import time
 import threading
-from typing import List, Dict, Any, Optional, Callable
+from collections import defaultdict, deque
+from itertools import islice
+from typing import List, Dict, Any, Optional
 import re
-from concurrent.futures import ThreadPoolExecutor
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Number of locks striped across conversations
+CONVERSATION_LOCK_STRIPES = 64
+
+# Conversation ages are tracked in integer monotonic nanoseconds
+NS_PER_SECOND = 1_000_000_000
+
+# Number of times a user can interrupt a single response
+INTERRUPT_THRESHOLD = 3
+
+# Basic intent recognition for real estate topics, in priority order
+INTENT_KEYWORDS = {
+    'buying': ['buy', 'purchase', 'home', 'property', 'real estate'],
+    'selling': ['sell', 'listing', 'market', 'price', 'value'],
+    'mortgage': ['loan', 'finance', 'interest', 'rate', 'mortgage'],
+    'investment': ['invest', 'rental', 'income', 'property management'],
+    'market_info': ['market', 'trend', 'prices', 'appreciation']
+}
+
+# One pattern for all intent keywords; each branch scans the whole message before
+# the next is tried, so the first intent listed above still wins
+INTENT_RE = re.compile(
+    '^(?:' + '|'.join(
+        f'.*?(?P<{intent}>' + '|'.join(re.escape(keyword) for keyword in keywords) + ')'
+        for intent, keywords in INTENT_KEYWORDS.items()
+    ) + ')',
+    re.DOTALL
+)
+
+# Follow-up context lists, in the order they are scored
+FOLLOW_UP_KEYS = ('expected_topics', 'related_questions', 'context_keywords')
+
+# Asking for more on the same subject nudges a query towards being a follow-up
+MORE_RE = re.compile(r'\b(more|further|additional|again)\b')
+
+# Shared by every message and response stored without metadata; never mutate it
+EMPTY_METADATA: Dict[str, Any] = {}
+
+def compile_follow_up_pattern(terms: List[str]) -> re.Pattern:
+    """Compile one pattern matching any of the given lowercased follow-up terms"""
+    # An empty context never matches
+    if not terms:
+        return re.compile(r'(?!)')
+    return re.compile('|'.join(re.escape(term) for term in terms))
 
 class EnhancedConversationManager:
     """
@@ -19,25 +70,85 @@ class EnhancedConversationManager:
         Args:
             max_history_length: Maximum number of exchanges to keep in conversation history
         """
-        # Set up logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        self.logger = logging.getLogger(__name__)
+        self.logger = logger
         
         # Conversation tracking
         self.conversations: Dict[str, Dict[str, Any]] = {}
         self.max_history_length = max_history_length
         
-        # Conversation state management
-        self.conversation_lock = threading.RLock()  # Using RLock to prevent deadlocks
+        # Conversation state management: striped locks keyed by call SID so
+        # different calls don't contend, RLocks so methods can call each other
+        self._stripes = [threading.RLock() for _ in range(CONVERSATION_LOCK_STRIPES)]
+        # Guards inserts into and deletes from the conversations table
+        self._table_lock = threading.Lock()
+        
+        # Min-heap of (last_interaction_time ns, call_sid) so cleanup only visits expired
+        # conversations; superseded entries stay in the heap and are skipped when popped
+        self._expiry_heap: List[tuple] = []
+        self._heap_lock = threading.Lock()
+        # Set when a new earliest expiry is scheduled or the cleanup thread should stop
+        self._wake = threading.Event()
+        self._stopped = False
         
-        # Active responses tracking
+        # Active responses tracking, indexed by call SID for teardown
         self.active_responses: Dict[str, Dict[str, Any]] = {}
+        self._responses_by_call: Dict[str, set] = defaultdict(set)
         
         self.logger.info("EnhancedConversationManager initialized")
     
+    def _stripe(self, call_sid: str) -> threading.RLock:
+        """Return the lock guarding the conversation for the given call SID"""
+        return self._stripes[hash(call_sid) % CONVERSATION_LOCK_STRIPES]
+    
+    def _touch(self, call_sid: str) -> int:
+        """Schedule the conversation for expiry and return the new last interaction time"""
+        timestamp = time.monotonic_ns()
+        entry = (timestamp, call_sid)
+        with self._heap_lock:
+            heapq.heappush(self._expiry_heap, entry)
+            earliest = self._expiry_heap[0] is entry
+        if earliest:
+            self._wake.set()
+        return timestamp
+    
+    def wait_for_expiry(self, max_age_seconds: int) -> bool:
+        """
+        Block until the oldest conversation may have gone stale or stop() is called
+        
+        Args:
+            max_age_seconds: Maximum age in seconds before a conversation is considered stale
+            
+        Returns:
+            False once the manager has been stopped, True otherwise
+        """
+        with self._heap_lock:
+            oldest = self._expiry_heap[0][0] if self._expiry_heap else None
+        if oldest is None:
+            timeout = max_age_seconds
+        else:
+            timeout = max(0, oldest + max_age_seconds * NS_PER_SECOND - time.monotonic_ns()) / NS_PER_SECOND
+        self._wake.wait(timeout)
+        self._wake.clear()
+        return not self._stopped
+    
+    def stop(self):
+        """Wake and stop the background cleanup thread"""
+        self._stopped = True
+        self._wake.set()
+    
+    def _ensure_shape(self, conversation: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in any missing conversation sections so other methods can index them directly"""
+        state = conversation.setdefault('state', {})
+        state.setdefault('intent', None)
+        state.setdefault('total_interactions', 0)
+        conversation.setdefault('follow_up_context', {key: () for key in FOLLOW_UP_KEYS})
+        conversation.setdefault('interruption_management', {
+            'active_response_token': None,
+            'can_interrupt': True,
+            'interrupt_threshold': INTERRUPT_THRESHOLD
+        })
+        return conversation
+    
     def initialize_conversation(self, call_sid: str, initial_context: Dict[str, Any] = None) -> bool:
         """
         Initialize a new conversation for a specific call with enhanced tracking
@@ -54,44 +165,33 @@ class EnhancedConversationManager:
             return False
             
         try:
-            with self.conversation_lock:
+            with self._stripe(call_sid):
                 if call_sid not in self.conversations:
-                    self.conversations[call_sid] = {
-                        'history': [],
+                    conversation = self._ensure_shape({
+                        'history': deque(maxlen=self.max_history_length * 2),
                         'state': {
                             'current_topic': None,
-                            'intent': None,
                             'context': initial_context or {},
-                            'last_interaction_time': time.time(),
-                            'total_interactions': 0,
+                            'last_interaction_time': self._touch(call_sid),
                             'conversation_type': 'initial'
-                        },
-                        'follow_up_context': {
-                            'expected_topics': [],
-                            'related_questions': [],
-                            'context_keywords': []
-                        },
-                        'interruption_management': {
-                            'active_response_token': None,
-                            'can_interrupt': True,
-                            'interrupt_threshold': 3  # Number of times user can interrupt
                         }
-                    }
+                    })
+                    with self._table_lock:
+                        self.conversations[call_sid] = conversation
                     
-                    self.logger.info(f"Initialized enhanced conversation for call SID: {call_sid}")
+                    self.logger.info("Initialized enhanced conversation for call SID: %s", call_sid)
                     return True
                 return False
         except Exception as e:
-            self.logger.error(f"Error initializing conversation for call SID {call_sid}: {str(e)}")
+            self.logger.error("Error initializing conversation for call SID %s: %s", call_sid, e)
             # Create a basic conversation structure to prevent further errors
-            with self.conversation_lock:
+            with self._stripe(call_sid):
                 if call_sid not in self.conversations:
-                    self.conversations[call_sid] = {
-                        'history': [],
-                        'state': {'last_interaction_time': time.time()},
-                        'follow_up_context': {},
-                        'interruption_management': {'can_interrupt': True}
-                    }
+                    with self._table_lock:
+                        self.conversations[call_sid] = self._ensure_shape({
+                            'history': deque(maxlen=self.max_history_length * 2),
+                            'state': {'last_interaction_time': self._touch(call_sid)}
+                        })
             return False
     
     def add_follow_up_context(
@@ -118,37 +218,58 @@ class EnhancedConversationManager:
             return False
             
         try:
-            with self.conversation_lock:
+            with self._stripe(call_sid):
                 if call_sid not in self.conversations:
                     if not self.initialize_conversation(call_sid):
-                        self.logger.error(f"Failed to initialize conversation for call SID: {call_sid}")
+                        self.logger.error("Failed to initialize conversation for call SID: %s", call_sid)
                         return False
                 
-                # Update follow-up context
-                follow_up_context = self.conversations[call_sid]['follow_up_context']
+                # Update follow-up context by publishing a new copy, so readers holding
+                # the previous one never see it change
+                conversation = self.conversations[call_sid]
+                follow_up_context = dict(conversation['follow_up_context'])
                 
                 if expected_topics:
-                    follow_up_context['expected_topics'] = expected_topics
+                    follow_up_context['expected_topics'] = tuple(expected_topics)
                 
                 if related_questions:
-                    follow_up_context['related_questions'] = related_questions
+                    follow_up_context['related_questions'] = tuple(related_questions)
                 
                 if context_keywords:
-                    follow_up_context['context_keywords'] = context_keywords
+                    follow_up_context['context_keywords'] = tuple(context_keywords)
+                
+                # Lowercase every term once here instead of on every scored turn, and
+                # compile a pattern that lets scoring skip the checks when nothing can match.
+                # Both are kept apart from the context returned to callers.
+                lowered = {
+                    key: tuple((term, term.lower()) for term in follow_up_context[key])
+                    for key in FOLLOW_UP_KEYS
+                }
+                pattern = compile_follow_up_pattern(
+                    [term_lower for key in FOLLOW_UP_KEYS for _, term_lower in lowered[key]]
+                )
+                conversation['follow_up_context'] = follow_up_context
+                conversation['follow_up_matcher'] = (pattern, lowered)
                 
-                self.logger.debug(f"Updated follow-up context for call SID: {call_sid}")
+                self.logger.debug("Updated follow-up context for call SID: %s", call_sid)
                 return True
         except Exception as e:
-            self.logger.error(f"Error adding follow-up context for call SID {call_sid}: {str(e)}")
+            self.logger.error("Error adding follow-up context for call SID %s: %s", call_sid, e)
             return False
     
-    def evaluate_follow_up_relevance(self, call_sid: str, new_query: str) -> Dict[str, Any]:
+    def evaluate_follow_up_relevance(
+        self, 
+        call_sid: str, 
+        new_query: str, 
+        query_lower: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         Evaluate the relevance of a follow-up query with advanced matching
         
         Args:
             call_sid: Unique identifier for the call
             new_query: New user query
+            query_lower: Optional lowercased query, if the caller already has one
         
         Returns:
             Detailed follow-up relevance assessment
@@ -158,51 +279,41 @@ class EnhancedConversationManager:
             return {'is_follow_up': False, 'confidence': 0.0, 'error': 'Empty call SID or query'}
             
         try:
-            with self.conversation_lock:
-                if call_sid not in self.conversations:
-                    self.logger.warning(f"Call SID {call_sid} not found in existing conversations")
-                    return {'is_follow_up': False, 'confidence': 0.0, 'matched_context': []}
-                
-                follow_up_context = self.conversations[call_sid]['follow_up_context']
+            # No lock needed: the follow-up context is replaced, never mutated
+            conversation = self.conversations.get(call_sid)
+            if conversation is None:
+                self.logger.warning("Call SID %s not found in existing conversations", call_sid)
+                return {'is_follow_up': False, 'confidence': 0.0, 'matched_context': []}
+            
+            if query_lower is None:
                 query_lower = new_query.lower()
-                
-                # Initialize match tracking
+            
+            # One scan of the query rules out most turns before any per-term check;
+            # contexts never set through add_follow_up_context have no terms
+            pattern, lowered = conversation.get('follow_up_matcher', (None, None))
+            if pattern is not None and pattern.search(query_lower):
                 matched_context = {
-                    'expected_topics': [],
-                    'related_questions': [],
-                    'context_keywords': []
-                }
-                confidence = 0.0
-                
-                # Check expected topics
-                for topic in follow_up_context.get('expected_topics', []):
-                    if topic.lower() in query_lower:
-                        matched_context['expected_topics'].append(topic)
-                        confidence += 0.4
-                
-                # Check related questions
-                for question in follow_up_context.get('related_questions', []):
-                    if question.lower() in query_lower:
-                        matched_context['related_questions'].append(question)
-                        confidence += 0.3
-                
-                # Check context keywords
-                for keyword in follow_up_context.get('context_keywords', []):
-                    if keyword.lower() in query_lower:
-                        matched_context['context_keywords'].append(keyword)
-                        confidence += 0.2
-                
-                # Apply semantic understanding rules
-                if re.search(r'\b(more|further|additional|again)\b', query_lower):
-                    confidence += 0.1
-                
-                return {
-                    'is_follow_up': confidence > 0.5,
-                    'confidence': min(confidence, 1.0),
-                    'matched_context': matched_context
+                    key: [term for term, term_lower in lowered[key] if term_lower in query_lower]
+                    for key in FOLLOW_UP_KEYS
                 }
+            else:
+                matched_context = {key: [] for key in FOLLOW_UP_KEYS}
+            
+            # Weight topics over questions over keywords, plus the semantic nudge
+            confidence = (
+                0.4 * len(matched_context['expected_topics'])
+                + 0.3 * len(matched_context['related_questions'])
+                + 0.2 * len(matched_context['context_keywords'])
+                + 0.1 * bool(MORE_RE.search(query_lower))
+            )
+            
+            return {
+                'is_follow_up': confidence > 0.5,
+                'confidence': min(confidence, 1.0),
+                'matched_context': matched_context
+            }
         except Exception as e:
-            self.logger.error(f"Error evaluating follow-up relevance: {str(e)}")
+            self.logger.error("Error evaluating follow-up relevance: %s", e)
             return {'is_follow_up': False, 'confidence': 0.0, 'error': str(e)}
     
     def track_active_response(
@@ -227,38 +338,31 @@ class EnhancedConversationManager:
             return False
             
         try:
-            with self.conversation_lock:
+            with self._stripe(call_sid):
                 if call_sid not in self.conversations:
                     if not self.initialize_conversation(call_sid):
-                        self.logger.error(f"Failed to initialize conversation for call SID: {call_sid}")
+                        self.logger.error("Failed to initialize conversation for call SID: %s", call_sid)
                         return False
                 
                 # Track active response
                 self.active_responses[response_token] = {
                     'call_sid': call_sid,
-                    'start_time': time.time(),
-                    'metadata': metadata or {},
+                    'start_time': time.monotonic_ns(),
+                    'metadata': metadata if metadata is not None else EMPTY_METADATA,
                     'status': 'active',
                     'interruption_count': 0
                 }
+                self._responses_by_call[call_sid].add(response_token)
                 
                 # Update conversation's active response
-                conversation = self.conversations[call_sid]
-                if 'interruption_management' in conversation:
-                    conversation['interruption_management']['active_response_token'] = response_token
-                    conversation['interruption_management']['can_interrupt'] = True
-                else:
-                    # Ensure interruption_management exists
-                    conversation['interruption_management'] = {
-                        'active_response_token': response_token,
-                        'can_interrupt': True,
-                        'interrupt_threshold': 3
-                    }
+                interrupt_mgmt = self.conversations[call_sid]['interruption_management']
+                interrupt_mgmt['active_response_token'] = response_token
+                interrupt_mgmt['can_interrupt'] = True
                 
-                self.logger.debug(f"Tracking active response: {response_token}")
+                self.logger.debug("Tracking active response: %s", response_token)
                 return True
         except Exception as e:
-            self.logger.error(f"Error tracking active response for call SID {call_sid}: {str(e)}")
+            self.logger.error("Error tracking active response for call SID %s: %s", call_sid, e)
             return False
     
     def handle_response_interruption(
@@ -281,14 +385,13 @@ class EnhancedConversationManager:
             return {'success': False, 'message': 'Empty response token'}
             
         try:
-            with self.conversation_lock:
-                if response_token not in self.active_responses:
-                    self.logger.warning(f"Response token {response_token} not found in active responses")
-                    return {'success': False, 'message': 'Response not found'}
-                
-                response_info = self.active_responses[response_token]
-                call_sid = response_info['call_sid']
-                
+            response_info = self.active_responses.get(response_token)
+            if response_info is None:
+                self.logger.warning("Response token %s not found in active responses", response_token)
+                return {'success': False, 'message': 'Response not found'}
+            
+            call_sid = response_info['call_sid']
+            with self._stripe(call_sid):
                 # Mark response as interrupted
                 response_info['status'] = 'interrupted'
                 response_info['interrupt_reason'] = interrupt_reason
@@ -296,22 +399,12 @@ class EnhancedConversationManager:
                 
                 # Check if conversation exists
                 if call_sid not in self.conversations:
-                    self.logger.warning(f"Call SID {call_sid} not found during interruption handling")
+                    self.logger.warning("Call SID %s not found during interruption handling", call_sid)
                     return {'success': True, 'message': 'Response interrupted but conversation not found'}
                     
-                conversation = self.conversations[call_sid]
-                
-                # Check if interruption_management exists, create if not
-                if 'interruption_management' not in conversation:
-                    conversation['interruption_management'] = {
-                        'active_response_token': None,
-                        'can_interrupt': True,
-                        'interrupt_threshold': 3
-                    }
-                
                 # Check interruption threshold
-                interrupt_mgmt = conversation['interruption_management']
-                if response_info['interruption_count'] > interrupt_mgmt.get('interrupt_threshold', 3):
+                interrupt_mgmt = self.conversations[call_sid]['interruption_management']
+                if response_info['interruption_count'] > interrupt_mgmt['interrupt_threshold']:
                     interrupt_mgmt['can_interrupt'] = False
                     return {
                         'success': False, 
@@ -321,7 +414,7 @@ class EnhancedConversationManager:
                 # Reset active response token
                 interrupt_mgmt['active_response_token'] = None
                 
-                self.logger.info(f"Interrupted response: {response_token}")
+                self.logger.info("Interrupted response: %s", response_token)
                 
                 return {
                     'success': True, 
@@ -329,7 +422,7 @@ class EnhancedConversationManager:
                     'interruption_count': response_info['interruption_count']
                 }
         except Exception as e:
-            self.logger.error(f"Error handling response interruption: {str(e)}")
+            self.logger.error("Error handling response interruption: %s", e)
             return {'success': False, 'message': f'Error: {str(e)}'}
     
     def add_conversation_message(
@@ -337,7 +430,8 @@ class EnhancedConversationManager:
         call_sid: str, 
         role: str, 
         content: str, 
-        metadata: Dict[str, Any] = None
+        metadata: Dict[str, Any] = None,
+        content_lower: Optional[str] = None
     ) -> bool:
         """
         Add a message to the conversation history with enhanced tracking
@@ -347,6 +441,7 @@ class EnhancedConversationManager:
             role: Role of the message sender (user/assistant)
             content: Message content
             metadata: Optional metadata about the message
+            content_lower: Optional lowercased content, shared with evaluate_follow_up_relevance
             
         Returns:
             True if message was added successfully, False otherwise
@@ -356,10 +451,10 @@ class EnhancedConversationManager:
             return False
             
         try:
-            with self.conversation_lock:
+            with self._stripe(call_sid):
                 if call_sid not in self.conversations:
                     if not self.initialize_conversation(call_sid):
-                        self.logger.error(f"Failed to initialize conversation for call SID: {call_sid}")
+                        self.logger.error("Failed to initialize conversation for call SID: %s", call_sid)
                         return False
                 
                 conversation = self.conversations[call_sid]
@@ -369,36 +464,26 @@ class EnhancedConversationManager:
                     'role': role,
                     'content': content,
                     'timestamp': time.time(),
-                    'metadata': metadata or {},
+                    'metadata': metadata if metadata is not None else EMPTY_METADATA,
                     'message_id': f"{call_sid}_{len(conversation['history']) + 1}"
                 }
                 
-                # Add message to history
+                # Add message to history; the deque drops the oldest past max length
                 conversation['history'].append(message)
                 
-                # Trim history if it exceeds max length
-                if len(conversation['history']) > self.max_history_length * 2:
-                    conversation['history'] = conversation['history'][-self.max_history_length * 2:]
-                
-                # Ensure state exists
-                if 'state' not in conversation:
-                    conversation['state'] = {
-                        'last_interaction_time': time.time(),
-                        'total_interactions': 0
-                    }
-                
                 # Update conversation state
-                conversation['state']['last_interaction_time'] = time.time()
-                conversation['state']['total_interactions'] = conversation['state'].get('total_interactions', 0) + 1
+                state = conversation['state']
+                state['last_interaction_time'] = self._touch(call_sid)
+                state['total_interactions'] += 1
                 
                 # Update intent tracking if it's a user message
                 if role == 'user':
-                    self._update_conversation_intent(call_sid, content)
+                    self._update_conversation_intent(conversation, content, content_lower)
                 
-                self.logger.debug(f"Added message to conversation history for call SID: {call_sid}")
+                self.logger.debug("Added message to conversation history for call SID: %s", call_sid)
                 return True
         except Exception as e:
-            self.logger.error(f"Error adding conversation message for call SID {call_sid}: {str(e)}")
+            self.logger.error("Error adding conversation message for call SID %s: %s", call_sid, e)
             return False
     
     def get_conversation_context(self, call_sid: str, max_messages: int = None) -> Dict[str, Any]:
@@ -410,93 +495,70 @@ class EnhancedConversationManager:
             max_messages: Optional maximum number of messages to include
         
         Returns:
-            Current conversation context
+            Current conversation context; callers must treat the returned
+            sections as read-only
         """
         if not call_sid:
             self.logger.error("Cannot get conversation context with empty call SID")
             return {'history': [], 'state': {}, 'context': {}, 'error': 'Empty call SID'}
             
         try:
-            with self.conversation_lock:
-                if call_sid not in self.conversations:
-                    self.logger.warning(f"Call SID {call_sid} not found when getting conversation context")
-                    return {'history': [], 'state': {}, 'context': {}}
-                
-                conversation = self.conversations[call_sid]
-                
-                # Get history with optional limit
-                history = conversation.get('history', [])
-                if max_messages and len(history) > max_messages:
-                    history = history[-max_messages:]
-                
-                # Ensure all required fields exist
-                if 'state' not in conversation:
-                    conversation['state'] = {}
-                    
-                if 'follow_up_context' not in conversation:
-                    conversation['follow_up_context'] = {}
-                    
-                if 'interruption_management' not in conversation:
-                    conversation['interruption_management'] = {}
-                
-                return {
-                    'history': history,
-                    'state': conversation.get('state', {}),
-                    'follow_up_context': conversation.get('follow_up_context', {}),
-                    'interruption_management': conversation.get('interruption_management', {})
-                }
+            # Reads take no lock: the table lookup and the C-level deque copy are
+            # each atomic under the GIL, and every conversation is created with all
+            # four sections, so nothing is written here
+            conversation = self.conversations.get(call_sid)
+            if conversation is None:
+                self.logger.warning("Call SID %s not found when getting conversation context", call_sid)
+                return {'history': [], 'state': {}, 'context': {}}
+            
+            # Get history with optional limit, copied out of the live deque
+            history = conversation['history']
+            if max_messages and len(history) > max_messages:
+                history = list(islice(history, len(history) - max_messages, None))
+            else:
+                history = list(history)
+            
+            return {
+                'history': history,
+                'state': conversation['state'],
+                'follow_up_context': conversation['follow_up_context'],
+                'interruption_management': conversation['interruption_management']
+            }
         except Exception as e:
-            self.logger.error(f"Error getting conversation context for call SID {call_sid}: {str(e)}")
+            self.logger.error("Error getting conversation context for call SID %s: %s", call_sid, e)
             return {'history': [], 'state': {}, 'context': {}, 'error': str(e)}
     
-    def _update_conversation_intent(self, call_sid: str, user_content: str):
+    def _update_conversation_intent(
+        self, 
+        conversation: Dict[str, Any], 
+        user_content: str, 
+        content_lower: Optional[str] = None
+    ):
         """
-        Update conversation intent based on user message
+        Update conversation intent based on user message; the caller holds the stripe lock
         
         Args:
-            call_sid: Unique identifier for the call
+            conversation: Conversation being updated
             user_content: User's message content
+            content_lower: Optional lowercased content, if the caller already has one
         """
-        if not call_sid or not user_content:
-            self.logger.error("Cannot update conversation intent with empty call SID or user content")
+        if not user_content:
+            self.logger.error("Cannot update conversation intent with empty user content")
             return
             
         try:
-            # Basic intent recognition for real estate topics
-            intent_keywords = {
-                'buying': ['buy', 'purchase', 'home', 'property', 'real estate'],
-                'selling': ['sell', 'listing', 'market', 'price', 'value'],
-                'mortgage': ['loan', 'finance', 'interest', 'rate', 'mortgage'],
-                'investment': ['invest', 'rental', 'income', 'property management'],
-                'market_info': ['market', 'trend', 'prices', 'appreciation']
-            }
-            
             # Convert to lowercase for case-insensitive matching
-            content_lower = user_content.lower()
+            if content_lower is None:
+                content_lower = user_content.lower()
             
             # Find the most likely intent
-            with self.conversation_lock:
-                if call_sid not in self.conversations:
-                    self.logger.warning(f"Call SID {call_sid} not found when updating conversation intent")
-                    return
-                    
-                conversation = self.conversations[call_sid]
-                
-                # Ensure state exists
-                if 'state' not in conversation:
-                    conversation['state'] = {
-                        'intent': None,
-                        'last_interaction_time': time.time(),
-                        'total_interactions': 0
-                    }
-                
-                for intent, keywords in intent_keywords.items():
-                    if any(keyword in content_lower for keyword in keywords):
-                        conversation['state']['intent'] = intent
-                        self.logger.debug(f"Detected intent: {intent}")
-                        break
+            match = INTENT_RE.match(content_lower)
+            if match:
+                intent = match.lastgroup
+                conversation['state']['intent'] = intent
+                self.logger.debug("Detected intent: %s", intent)
         except Exception as e:
-            self.logger.error(f"Error updating conversation intent for call SID {call_sid}: {str(e)}")
+            self.logger.error("Error updating conversation intent: %s", e)
 
     def cleanup_stale_conversations(self, max_age_seconds: int = 3600) -> int:
         """
@@ -514,37 +576,34 @@ class EnhancedConversationManager:
             
         try:
             removed_count = 0
-            current_time = time.time()
+            cutoff = time.monotonic_ns() - max_age_seconds * NS_PER_SECOND
             
-            with self.conversation_lock:
-                # Find stale conversations
-                stale_conversations = []
-                for call_sid, conv in list(self.conversations.items()):
-                    # Ensure 'state' exists with 'last_interaction_time'
-                    if 'state' not in conv or 'last_interaction_time' not in conv['state']:
-                        # If state is missing, consider it stale
-                        stale_conversations.append(call_sid)
-                    elif current_time - conv['state']['last_interaction_time'] > max_age_seconds:
-                        stale_conversations.append(call_sid)
-                
-                # Remove stale conversations
-                for call_sid in stale_conversations:
-                    del self.conversations[call_sid]
+            # Pop only the expired heap entries, then check each under its own stripe
+            expired = []
+            with self._heap_lock:
+                while self._expiry_heap and self._expiry_heap[0][0] < cutoff:
+                    expired.append(heapq.heappop(self._expiry_heap))
+            
+            for last_interaction_time, call_sid in expired:
+                with self._stripe(call_sid):
+                    # Entries superseded by later interactions no longer match the conversation
+                    conv = self.conversations.get(call_sid)
+                    if conv is None or conv['state']['last_interaction_time'] != last_interaction_time:
+                        continue
+                    
+                    # Remove stale conversation and its related active responses
+                    with self._table_lock:
+                        del self.conversations[call_sid]
+                    for response_token in self._responses_by_call.pop(call_sid, ()):
+                        self.active_responses.pop(response_token, None)
                     removed_count += 1
-                
-                # Clean up related data structures
-                stale_responses = [
-                    response_token for response_token, response_info in list(self.active_responses.items())
-                    if response_info['call_sid'] in stale_conversations
-                ]
-                
-                for response_token in stale_responses:
-                    del self.active_responses[response_token]
-                
-                self.logger.info(f"Removed {removed_count} stale conversations")
-                return removed_count
+            
+            # Wake-ups for a new earliest conversation usually find nothing to remove
+            if removed_count:
+                self.logger.info("Removed %s stale conversations", removed_count)
+            return removed_count
         except Exception as e:
-            self.logger.error(f"Error cleaning up stale conversations: {str(e)}")
+            self.logger.error("Error cleaning up stale conversations: %s", e)
             return 0
             
     def cleanup_conversation(self, call_sid: str) -> bool:
@@ -562,27 +621,23 @@ class EnhancedConversationManager:
             return False
             
         try:
-            with self.conversation_lock:
+            with self._stripe(call_sid):
                 if call_sid not in self.conversations:
-                    self.logger.warning(f"Call SID {call_sid} not found when cleaning up conversation")
+                    self.logger.warning("Call SID %s not found when cleaning up conversation", call_sid)
                     return False
                 
                 # Remove the conversation
-                del self.conversations[call_sid]
+                with self._table_lock:
+                    del self.conversations[call_sid]
                 
                 # Clean up related active responses
-                response_tokens_to_remove = [
-                    response_token for response_token, response_info in list(self.active_responses.items())
-                    if response_info['call_sid'] == call_sid
-                ]
+                for response_token in self._responses_by_call.pop(call_sid, ()):
+                    self.active_responses.pop(response_token, None)
                 
-                for response_token in response_tokens_to_remove:
-                    del self.active_responses[response_token]
-                
-                self.logger.info(f"Cleaned up conversation for call SID: {call_sid}")
+                self.logger.info("Cleaned up conversation for call SID: %s", call_sid)
                 return True
         except Exception as e:
-            self.logger.error(f"Error cleaning up conversation for call SID {call_sid}: {str(e)}")
+            self.logger.error("Error cleaning up conversation for call SID %s: %s", call_sid, e)
             return False
 
 # Initialize a global enhanced conversation manager
@@ -597,20 +652,19 @@ def start_conversation_cleanup(conversation_manager, interval=3600):
         interval: Time between cleanup runs (in seconds)
     """
     if interval <= 0:
-        conversation_manager.logger.error(f"Invalid cleanup interval: {interval}")
+        conversation_manager.logger.error("Invalid cleanup interval: %s", interval)
         interval = 3600  # Use default if invalid
         
     def cleanup_worker():
-        while True:
+        # Sleep until the oldest conversation can expire rather than on a fixed tick
+        while conversation_manager.wait_for_expiry(interval):
             try:
                 # Use the conversation manager's cleanup method
                 removed = conversation_manager.cleanup_stale_conversations(interval)
-                conversation_manager.logger.info(f"Periodic cleanup removed {removed} stale conversations")
-                
-                # Sleep between cleanup runs
-                time.sleep(interval)
+                if removed:
+                    conversation_manager.logger.info("Periodic cleanup removed %s stale conversations", removed)
             except Exception as e:
-                conversation_manager.logger.error(f"Error in conversation cleanup thread: {e}")
+                conversation_manager.logger.error("Error in conversation cleanup thread: %s", e)
                 # Don't crash the thread, just retry after a delay
                 time.sleep(60)
     
@@ -0,0 +1,46 @@
+# Gunicorn settings for the telecaller webhooks
+#
+#   gunicorn app:app
+#
+# Keep-alive is terminated by nginx in front of the unix socket:
+#
+#   upstream telecaller {
+#       server unix:/tmp/telecaller.sock;
+#       keepalive 64;
+#   }
+#   location / {
+#       proxy_pass http://telecaller;
+#       proxy_http_version 1.1;
+#       proxy_set_header Connection "";
+#       proxy_set_header Host $host;
+#       proxy_set_header X-Forwarded-Proto $scheme;
+#   }
+import multiprocessing
+from uvicorn.workers import UvicornWorker
+from config import ENV
+
+class TelecallerWorker(UvicornWorker):
+    # app.py installs the io_uring or uvloop policy at import; Uvicorn's default
+    # "auto" loop setup would replace it, so leave the event loop to the policy
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, 'loop': 'none'}
+
+worker_class = TelecallerWorker
+workers = int(ENV.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+keepalive = 30
+
+# Import the app once in the master so config, fixed TwiML and the knowledge
+# base are shared copy-on-write; clients, pools and threads are created by
+# CallHandler.start() in each worker's before_serving hook
+preload_app = True
+
+# PORT binds a TCP socket directly; otherwise serve nginx over a unix socket
+if ENV.get('PORT'):
+    bind = f"0.0.0.0:{ENV['PORT']}"
+else:
+    bind = ENV.get('BIND', 'unix:/tmp/telecaller.sock')
+
+accesslog = None
+
+def when_ready(server):
+    print(f"Server listening on {bind}")
+    print("Real Estate Telecaller System is ready to make calls")
@@ -2,15 +2,19 @@
 Enhanced interruption handling for real estate AI telecaller system.
 This module adds speech interruption detection and handling.
 """
-import os
+import atexit
 import logging
 import time
 import threading
-import re
-from typing import Dict, Any, Optional
+from itertools import count
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable
 
 from twilio.twiml.voice_response import VoiceResponse, Gather
-from flask import request
+
+from config import ENV, WEBHOOK_URL_OVERRIDES, INTERRUPT_URL_OVERRIDES
+from conversation_manager import global_enhanced_conversation_manager
 
 # Configure logging
 logging.basicConfig(
@@ -20,6 +24,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Number of locks striped across active responses
+RESPONSE_LOCK_STRIPES = 16
+
+# Responses still registered this long after they started were abandoned, e.g. by
+# a hang-up mid-playback, and are dropped
+RESPONSE_TTL = int(ENV.get('RESPONSE_TTL', 600))
+
+# Speech recognized below this confidence is treated as line noise, not an interruption
+MIN_INTERRUPT_CONFIDENCE = float(ENV.get('MIN_INTERRUPT_CONFIDENCE', 0.4))
+
+# Playback resumed after line noise at most this many times per response; after
+# that the rest of the response is dropped and the call moves on
+MAX_NOISE_RESUMES = int(ENV.get('MAX_NOISE_RESUMES', 3))
+
+# Twilio doesn't report how far a barged-in Gather got, so progress is estimated
+# from elapsed time. Slower than the real rate, so a sentence in progress is
+# repeated rather than skipped.
+SPEECH_CHARS_PER_SECOND = 10
+
+def count_spoken_chunks(chunks: list, elapsed: float) -> int:
+    """Return how many chunks have certainly finished playing after elapsed seconds"""
+    spoken = 0
+    for chunk in chunks:
+        elapsed -= len(chunk) / SPEECH_CHARS_PER_SECOND
+        if elapsed < 0:
+            break
+        spoken += 1
+    return spoken
+
 class InterruptionHandler:
     """
     Handles voice interruptions during AI response playback
@@ -31,18 +64,53 @@ class InterruptionHandler:
         Args:
             conversation_manager: Conversation manager instance
         """
-        # Import here to avoid circular imports
         if conversation_manager is None:
-            from conversation_manager import global_enhanced_conversation_manager
-            self.conversation_manager = global_enhanced_conversation_manager
-        else:
-            self.conversation_manager = conversation_manager
+            conversation_manager = global_enhanced_conversation_manager
+        self.conversation_manager = conversation_manager
             
         self.active_responses = {}
-        self.response_lock = threading.RLock()
+        # Striped locks keyed by response ID so webhooks for different calls don't
+        # contend; never held while calling back into a method that takes one
+        self._response_locks = [threading.Lock() for _ in range(RESPONSE_LOCK_STRIPES)]
+        
+        # Response IDs are unique per process, even for several responses in one second
+        self._response_ids = count()
+        
+        # (start_time, response_id) in registration order, so expiry only visits
+        # the oldest responses; entries for finished responses are skipped
+        self._expiry_order = deque()
+        self._expiry_lock = threading.Lock()
+        
+        # Conversation bookkeeping runs here so TwiML is returned without waiting on it
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='interruption-bookkeeping')
+        
+        # Webhook URLs are fixed for the life of the process
+        self._base_url = ENV.get('SERVER_URL', 'http://localhost:5000')
+        self._interrupt_url = f"{self._base_url}/webhook/interrupt"
+        self._speech_url = f"{self._base_url}/webhook/speech{WEBHOOK_URL_OVERRIDES}"
+        self._voice_url = f"{self._base_url}/webhook/voice{WEBHOOK_URL_OVERRIDES}"
+        
+        # Fixed responses are rendered once; only chunk playback goes through the TwiML builder
+        self._render_fixed_twiml()
         
         logger.info("InterruptionHandler initialized")
     
+    def _response_lock(self, response_id: str) -> threading.Lock:
+        """Return the lock guarding the given response"""
+        return self._response_locks[hash(response_id) % RESPONSE_LOCK_STRIPES]
+    
+    def _expire_responses(self):
+        """Drop responses registered more than RESPONSE_TTL seconds ago"""
+        cutoff = time.monotonic() - RESPONSE_TTL
+        expired = []
+        with self._expiry_lock:
+            while self._expiry_order and self._expiry_order[0][0] < cutoff:
+                expired.append(self._expiry_order.popleft())
+        
+        for _, response_id in expired:
+            with self._response_lock(response_id):
+                self.active_responses.pop(response_id, None)
+    
     def register_response(self, call_sid: str, response_token: str, chunks: list) -> Dict[str, Any]:
         """
         Register a multi-chunk response for interruption handling
@@ -55,31 +123,38 @@ class InterruptionHandler:
         Returns:
             Dict with response_id
         """
-        with self.response_lock:
-            try:
-                response_id = f"{call_sid}_{int(time.time())}"
+        try:
+            self._expire_responses()
+            
+            start_time = time.monotonic()
+            response_id = f"{call_sid}_{next(self._response_ids)}"
+            with self._response_lock(response_id):
                 self.active_responses[response_id] = {
                     'call_sid': call_sid,
                     'response_token': response_token,
                     'chunks': chunks,
-                    'current_chunk': 0,
                     'status': 'pending',
-                    'start_time': time.time(),
-                    'interrupted': False,
-                    'interrupt_data': None
+                    'start_time': start_time,
+                    # First chunk of the Gather now playing, when it was served, and
+                    # how often line noise has restarted it
+                    'offset': 0,
+                    'played_at': None,
+                    'noise_resumes': 0
                 }
-                
-                # Also register in conversation manager for cross-reference
-                self.conversation_manager.track_active_response(call_sid, response_token, {
-                    'response_id': response_id,
-                    'chunks_count': len(chunks)
-                })
-                
-                logger.info(f"Registered response {response_id} with {len(chunks)} chunks")
-                return {'response_id': response_id}
-            except Exception as e:
-                logger.error(f"Error registering response: {str(e)}")
-                return {'response_id': f"{call_sid}_{int(time.time())}", 'error': str(e)}
+            with self._expiry_lock:
+                self._expiry_order.append((start_time, response_id))
+            
+            # Also register in conversation manager for cross-reference, off the reply path
+            self._submit(self.conversation_manager.track_active_response, call_sid, response_token, {
+                'response_id': response_id,
+                'chunks_count': len(chunks)
+            })
+            
+            logger.info("Registered response %s with %s chunks", response_id, len(chunks))
+            return {'response_id': response_id}
+        except Exception as e:
+            logger.error("Error registering response: %s", e)
+            return {'response_id': f"{call_sid}_{next(self._response_ids)}", 'error': str(e)}
     
     def start_response_playback(self, response_id: str) -> str:
         """
@@ -91,111 +166,76 @@ class InterruptionHandler:
         Returns:
             TwiML response
         """
-        with self.response_lock:
+        with self._response_lock(response_id):
             try:
                 if response_id not in self.active_responses:
-                    logger.error(f"Response ID {response_id} not found")
+                    logger.error("Response ID %s not found", response_id)
                     return self._create_error_response()
                 
                 response_data = self.active_responses[response_id]
                 response_data['status'] = 'active'
-                
-                # Create TwiML response with interruption detection
-                twiml = self._create_chunk_response(response_id)
-                return twiml
+                response_data['played_at'] = time.monotonic()
+                chunks = response_data['chunks']
             except Exception as e:
-                logger.error(f"Error starting response playback: {str(e)}")
+                logger.error("Error starting response playback: %s", e)
                 return self._create_error_response()
+        
+        # Nothing to play
+        if not chunks:
+            return self._create_completion_response(response_id)
+        
+        # Create TwiML response with interruption detection outside of lock
+        return self._create_chunk_response(response_id, chunks)
     
-    def _create_chunk_response(self, response_id: str) -> str:
+    def _create_chunk_response(self, response_id: str, chunks: list) -> str:
         """
-        Create TwiML response for current chunk with interruption detection
+        Create TwiML response speaking every chunk with interruption detection
         
         Args:
             response_id: ID of the response
+            chunks: List of response chunks
         
         Returns:
             TwiML response
         """
         try:
-            with self.response_lock:
-                if response_id not in self.active_responses:
-                    logger.error(f"Response ID {response_id} not found in _create_chunk_response")
-                    return self._create_error_response()
-                    
-                response_data = self.active_responses[response_id]
-                current_chunk_idx = response_data['current_chunk']
-                chunks = response_data['chunks']
-                
-                # Check if we've played all chunks
-                if current_chunk_idx >= len(chunks):
-                    return self._create_completion_response(response_id)
-                
-                # Get current chunk
-                current_chunk = chunks[current_chunk_idx]
-                
-            # Create response outside of lock to avoid deadlocks
             response = VoiceResponse()
             
-            # Set up interruption detection using <Gather>
-            base_url = os.environ.get('SERVER_URL', 'http://localhost:5000')
-            
-            # Use Gather with very short timeout and interruptible speech
+            # One Gather speaks all chunks back to back, so there is no webhook
+            # round-trip between sentences; speech at any point barges in and posts
+            # to the interrupt action, as does finishing with no speech at all
             gather = Gather(
                 input='speech',
-                action=f"{base_url}/webhook/interrupt?response_id={response_id}",
+                action=f"{self._interrupt_url}?response_id={response_id}{INTERRUPT_URL_OVERRIDES}",
                 timeout=1,  # Very short timeout
                 speechTimeout='auto',
                 actionOnEmptyResult=True,
                 enhanced=True,  # Enhanced speech recognition
-                interruptible='true',  # Allow interruption of TTS
+                bargeIn=True,  # Allow interruption of TTS
                 speechModel='phone_call'
             )
             
-            # Say the current chunk
-            gather.say(
-                current_chunk, 
-                voice='alice', 
-                rate="0.9"
-            )
+            for chunk in chunks:
+                gather.say(
+                    chunk, 
+                    voice='alice', 
+                    rate="0.9"
+                )
             
             response.append(gather)
             
-            # If not interrupted, proceed to next chunk
-            response.redirect(f"{base_url}/webhook/continue_response?response_id={response_id}")
-            
             return str(response)
         except Exception as e:
-            logger.error(f"Error creating chunk response: {str(e)}")
+            logger.error("Error creating chunk response: %s", e)
             return self._create_error_response()
     
-    def continue_response(self, response_id: str) -> str:
-        """
-        Continue to the next chunk of the response
-        
-        Args:
-            response_id: ID of the response
-        
-        Returns:
-            TwiML response
-        """
-        with self.response_lock:
-            try:
-                if response_id not in self.active_responses:
-                    logger.error(f"Response ID {response_id} not found in continue_response")
-                    return self._create_error_response()
-                
-                response_data = self.active_responses[response_id]
-                response_data['current_chunk'] += 1
-                
-            except Exception as e:
-                logger.error(f"Error continuing response: {str(e)}")
-                return self._create_error_response()
-            
-        # Create response outside of lock to avoid potential deadlocks
-        return self._create_chunk_response(response_id)
-    
-    def handle_interruption(self, response_id: str, speech_result: str = None, confidence: float = None) -> str:
+    def handle_interruption(
+        self, 
+        response_id: str, 
+        speech_result: str = None, 
+        confidence: float = None, 
+        get_param: Optional[Callable] = None
+    ) -> str:
         """
         Handle an interruption during response playback
         
@@ -203,67 +243,119 @@ class InterruptionHandler:
             response_id: ID of the interrupted response
             speech_result: What user said to interrupt
             confidence: Confidence level of speech recognition
+            get_param: Webhook form lookup, e.g. Quart's form.get, for values not passed in
         
         Returns:
             TwiML response
         """
-        # Get data from request if not provided
+        # Get data from the webhook form if not provided
+        if get_param is None:
+            get_param = {}.get
         if speech_result is None:
-            speech_result = request.values.get('SpeechResult', '')
+            speech_result = get_param('SpeechResult', '')
+        
+        # The Gather posts here with no speech once every chunk has played
+        if not speech_result.strip():
+            return self._create_completion_response(response_id)
+        
         if confidence is None:
             try:
-                confidence = float(request.values.get('Confidence', 0))
+                confidence = float(get_param('Confidence', 0))
             except (ValueError, TypeError):
                 confidence = 0.0
         
+        # Spurious detections resume playback at the sentence that was cut off,
+        # without touching the conversation
+        if confidence < MIN_INTERRUPT_CONFIDENCE:
+            logger.info("Ignoring low-confidence interruption of %s (%.2f)", response_id, confidence)
+            with self._response_lock(response_id):
+                response_data = self.active_responses.get(response_id)
+                if response_data is None:
+                    logger.error("Response ID %s not found for interruption", response_id)
+                    return self._create_error_response()
+                
+                response_data['noise_resumes'] += 1
+                now = time.monotonic()
+                chunks = response_data['chunks']
+                offset = response_data['offset']
+                if response_data['played_at'] is not None:
+                    offset += count_spoken_chunks(chunks[offset:], now - response_data['played_at'])
+                response_data['offset'] = offset
+                response_data['played_at'] = now
+                remaining = chunks[offset:]
+                give_up = response_data['noise_resumes'] > MAX_NOISE_RESUMES
+            
+            if give_up or not remaining:
+                return self._create_completion_response(response_id)
+            return self._create_chunk_response(response_id, remaining)
+        
         call_sid = None
         response_token = None
         
-        with self.response_lock:
+        with self._response_lock(response_id):
             try:
-                if response_id not in self.active_responses:
-                    logger.error(f"Response ID {response_id} not found for interruption")
+                # An interrupted response is finished; free it now rather than at expiry
+                response_data = self.active_responses.pop(response_id, None)
+                if response_data is None:
+                    logger.error("Response ID %s not found for interruption", response_id)
                     return self._create_error_response()
                 
-                response_data = self.active_responses[response_id]
                 call_sid = response_data['call_sid']
                 response_token = response_data['response_token']
                 
-                # Mark as interrupted
-                response_data['interrupted'] = True
-                response_data['status'] = 'interrupted'
-                response_data['interrupt_data'] = {
-                    'speech_result': speech_result,
-                    'confidence': confidence,
-                    'time': time.time()
-                }
-                
-                logger.info(f"Response {response_id} interrupted with: '{speech_result}'")
+                logger.info("Response %s interrupted with: '%s'", response_id, speech_result)
                 
             except Exception as e:
-                logger.error(f"Error handling interruption: {str(e)}")
+                logger.error("Error handling interruption: %s", e)
                 return self._create_error_response()
         
-        # These operations don't need to be in the lock
+        # These operations don't need to be in the lock, or to finish before we reply
         if call_sid and response_token:
-            # Notify conversation manager
-            self.conversation_manager.handle_response_interruption(response_token, 'user_interrupt')
-            
-            # Track interruption in conversation
-            self.conversation_manager.add_conversation_message(
-                call_sid,
-                role='user',
-                content=speech_result,
-                metadata={
-                    'type': 'interruption',
-                    'confidence': confidence,
-                    'response_token': response_token
-                }
-            )
+            self._submit(self._record_interruption, call_sid, response_token, speech_result, confidence)
             
         # Process the interruption
         return self._process_interruption(response_id, speech_result, call_sid)
     
+    def shutdown(self, wait: bool = True):
+        """Stop accepting background bookkeeping and optionally wait for queued work"""
+        self._executor.shutdown(wait=wait)
+    
+    def _submit(self, fn, *args):
+        """Run conversation bookkeeping in the background, logging any failure"""
+        self._executor.submit(fn, *args).add_done_callback(self._log_bookkeeping_error)
+    
+    @staticmethod
+    def _log_bookkeeping_error(future):
+        """Log an exception raised by a background bookkeeping call"""
+        error = future.exception()
+        if error is not None:
+            logger.error("Error in conversation bookkeeping: %s", error, exc_info=error)
+    
+    def _record_interruption(self, call_sid: str, response_token: str, speech_result: str, confidence: float):
+        """
+        Record an interruption with the conversation manager
+        
+        Args:
+            call_sid: Call SID
+            response_token: Token of the interrupted response
+            speech_result: What user said to interrupt
+            confidence: Confidence level of speech recognition
+        """
+        # Notify conversation manager
+        self.conversation_manager.handle_response_interruption(response_token, 'user_interrupt')
+        
+        # Track interruption in conversation
+        self.conversation_manager.add_conversation_message(
+            call_sid,
+            role='user',
+            content=speech_result,
+            metadata={
+                'type': 'interruption',
+                'confidence': confidence,
+                'response_token': response_token
+            }
+        )
+    
     def _process_interruption(self, response_id: str, speech_result: str, call_sid: str) -> str:
         """
         Process an interruption with context continuation
@@ -276,46 +368,8 @@ class InterruptionHandler:
         Returns:
             TwiML response with contextual reply
         """
-        try:
-            # Create TwiML response
-            response = VoiceResponse()
-            base_url = os.environ.get('SERVER_URL', 'http://localhost:5000')
-            
-            # Brief acknowledgment of interruption
-            response.say(
-                "I understand. Let me address that.",
-                voice='alice',
-                rate="0.9"
-            )
-            
-            # Set up to gather the user's full question after the interruption
-            followup_gathering = Gather(
-                input='speech',
-                action=f"{base_url}/webhook/speech",
-                timeout=5,
-                speechTimeout='auto',
-                enhanced=True,
-                language='en-US',
-                speechModel='phone_call'
-            )
-            
-            # Prompt for more details
-            followup_gathering.say(
-                "Please continue with your question.", 
-                voice='alice', 
-                rate="0.9"
-            )
-            
-            response.append(followup_gathering)
-            
-            # Fallback in case of no speech detected
-            response.say("I didn't hear anything. Please ask your question again.", voice='alice', rate="0.9")
-            response.redirect(f"{base_url}/webhook/voice")
-            
-            return str(response)
-        except Exception as e:
-            logger.error(f"Error processing interruption: {str(e)}")
-            return self._create_error_response()
+        # The acknowledgement and follow-up prompt are the same for every interruption
+        return self._interruption_twiml
     
     def _create_completion_response(self, response_id: str) -> str:
         """
@@ -327,49 +381,13 @@ class InterruptionHandler:
         Returns:
             TwiML response
         """
-        call_sid = None
-        
         # Clean up
-        with self.response_lock:
-            try:
-                if response_id not in self.active_responses:
-                    logger.error(f"Response ID {response_id} not found in completion")
-                    return self._create_error_response()
-                    
-                response_data = self.active_responses.pop(response_id, None)
-                call_sid = response_data['call_sid'] if response_data else None
-                
-            except Exception as e:
-                logger.error(f"Error in completion response: {str(e)}")
+        with self._response_lock(response_id):
+            if self.active_responses.pop(response_id, None) is None:
+                logger.error("Response ID %s not found in completion", response_id)
                 return self._create_error_response()
         
-        try:
-            # Create response with follow-up question
-            response = VoiceResponse()
-            
-            # Set up next gather
-            base_url = os.environ.get('SERVER_URL', 'http://localhost:5000')
-            gather = Gather(
-                input='speech',
-                action=f"{base_url}/webhook/speech",
-                timeout=5,
-                speechTimeout='auto',
-                enhanced=True,
-                language='en-US',
-                speechModel='phone_call'
-            )
-            
-            gather.say("Is there anything else you'd like to know?", voice='alice', rate="0.9")
-            response.append(gather)
-            
-            # Fallback
-            response.say("I didn't hear anything. How else can I help you?", voice='alice', rate="0.9")
-            response.redirect(f"{base_url}/webhook/voice")
-            
-            return str(response)
-        except Exception as e:
-            logger.error(f"Error creating completion response: {str(e)}")
-            return self._create_error_response()
+        return self._completion_twiml
     
     def _create_error_response(self) -> str:
         """
@@ -378,50 +396,55 @@ class InterruptionHandler:
         Returns:
             TwiML error response
         """
-        try:
+        return self._error_twiml
+    
+    def _render_fixed_twiml(self):
+        """Pre-render the TwiML documents whose content never changes"""
+        # Each is an optional lead-in, a speech Gather with a prompt, an optional
+        # no-input message, and a redirect if nothing is heard
+        def speech_prompt(lead_in, prompt, no_input):
             response = VoiceResponse()
-            response.say(
-                "I apologize for the technical difficulty. Let's try again.", 
-                voice='alice',
-                rate="0.9"
-            )
-            
-            base_url = os.environ.get('SERVER_URL', 'http://localhost:5000')
-            
-            # Set up gathering instead of redirecting immediately
+            if lead_in:
+                response.say(lead_in, voice='alice', rate="0.9")
             gather = Gather(
                 input='speech',
-                action=f"{base_url}/webhook/speech",
+                action=self._speech_url,
                 timeout=5,
                 speechTimeout='auto',
                 enhanced=True,
                 language='en-US',
                 speechModel='phone_call'
             )
-            
-            gather.say("How can I help you with your real estate questions?", voice='alice', rate="0.9")
+            gather.say(prompt, voice='alice', rate="0.9")
             response.append(gather)
-            
-            # Only redirect if no input
-            response.redirect(f"{base_url}/webhook/voice")
-            
+            if no_input:
+                response.say(no_input, voice='alice', rate="0.9")
+            response.redirect(self._voice_url)
             return str(response)
-        except Exception as e:
-            logger.error(f"Error creating error response: {str(e)}")
-            # Fallback to minimal response in case of severe error
-            return str(VoiceResponse().say("We're experiencing technical difficulties. Please call again later."))
+        
+        # Brief acknowledgment of interruption, then gather the user's full question
+        self._interruption_twiml = speech_prompt(
+            "I understand. Let me address that.",
+            "Please continue with your question.",
+            "I didn't hear anything. Please ask your question again."
+        )
+        # Follow-up question once every chunk has played
+        self._completion_twiml = speech_prompt(
+            None,
+            "Is there anything else you'd like to know?",
+            "I didn't hear anything. How else can I help you?"
+        )
+        # Gather again instead of redirecting immediately
+        self._error_twiml = speech_prompt(
+            "I apologize for the technical difficulty. Let's try again.",
+            "How can I help you with your real estate questions?",
+            None
+        )
 
-# Create singleton instance
-interruption_handler = None
+# Create singleton instance once at import
+interruption_handler = InterruptionHandler(global_enhanced_conversation_manager)
+atexit.register(interruption_handler.shutdown)
 
 def get_interruption_handler():
-    """Factory function to get or create singleton interruption handler"""
-    global interruption_handler
-    if interruption_handler is None:
-        try:
-            from conversation_manager import global_enhanced_conversation_manager
-            interruption_handler = InterruptionHandler(global_enhanced_conversation_manager)
-        except ImportError:
-            # Create without conversation manager, will be set later
-            interruption_handler = InterruptionHandler()
-    return interruption_handler
\ No newline at end of file
+    """Return the singleton interruption handler"""
+    return interruption_handler
@@ -2,6 +2,7 @@ import re
 import logging
 import string
 from difflib import get_close_matches
+from functools import lru_cache
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -147,6 +148,71 @@ REAL_ESTATE_KB = {
         "In competitive markets, multiple offers or bidding wars require strategic approaches. Effective strategies include getting pre-approved, offering clean contracts with minimal contingencies, flexible closing dates, personalized offer letters, and sometimes escalation clauses that automatically increase your bid to a predetermined limit. Our agents are skilled negotiators who can help position your offer to stand out in competitive situations.",
 }
 
+# All knowledge base patterns in one regex. Each branch scans the whole query
+# before the next is tried, so the first pattern listed above still wins; the
+# named group of the matching branch gives its index. preprocess_query lowercases
+# queries and every pattern is lowercase, so no IGNORECASE is needed. The patterns'
+# own groups only group alternatives, so they are made non-capturing and the
+# engine tracks just the 43 named groups
+KB_PATTERNS = list(REAL_ESTATE_KB)
+KB_RESPONSES = list(REAL_ESTATE_KB.values())
+KB_RE = re.compile(
+    '^(?:' + '|'.join(
+        f'.*?(?P<k{i}>(?:' + pattern.replace('(', '(?:') + '))'
+        for i, pattern in enumerate(KB_PATTERNS)
+    ) + ')',
+    re.DOTALL
+)
+
+# Every alternative of a pattern starts with a plain word (or a group of them), so
+# a query containing none of those words cannot match KB_RE and skips the scan
+TOP_LEVEL_ALTERNATION_RE = re.compile(r'\|(?![^()]*\))')
+LEADING_LITERAL_RE = re.compile(r'[^.()*]+')
+
+def leading_literals(pattern):
+    """Return the words one of which every match of a knowledge base pattern starts with"""
+    literals = set()
+    for alternative in TOP_LEVEL_ALTERNATION_RE.split(pattern):
+        heads = alternative[1:alternative.index(')')].split('|') if alternative.startswith('(') else [alternative]
+        literals.update(LEADING_LITERAL_RE.match(head).group() for head in heads)
+    return literals
+
+# Drop literals that contain a shorter one, e.g. "buying" once "buy" is checked
+_KB_LITERALS = set().union(*map(leading_literals, KB_PATTERNS))
+KB_LITERALS = tuple(sorted(
+    literal for literal in _KB_LITERALS
+    if not any(other != literal and other in literal for other in _KB_LITERALS)
+))
+
+# Alternations become word breaks and groups are dropped, in one translate pass
+PATTERN_SYNTAX_TABLE = str.maketrans({'|': ' ', '(': None, ')': None})
+
+def simplify_pattern(pattern):
+    """Strip regex syntax from a knowledge base pattern, leaving its words"""
+    return pattern.replace(r'.*', ' ').translate(PATTERN_SYNTAX_TABLE)
+
+# Fuzzy matching candidates: the significant words of each pattern, built once
+SIMPLIFIED_PATTERNS = []
+for _pattern in KB_PATTERNS:
+    _keywords = [w for w in simplify_pattern(_pattern).split() if len(w) > 3]  # Only keep significant words
+    if _keywords:
+        SIMPLIFIED_PATTERNS.append(' '.join(_keywords))
+
+# Each candidate maps to the first pattern whose simplified text contains it, or
+# None when dropping short words means no pattern does
+_SIMPLIFIED_KB = [(simplify_pattern(pattern), response) for pattern, response in REAL_ESTATE_KB.items()]
+SIMPLIFIED_TO_RESPONSE = {
+    candidate: next((response for simplified, response in _SIMPLIFIED_KB if candidate in simplified), None)
+    for candidate in SIMPLIFIED_PATTERNS
+}
+
+@lru_cache(maxsize=4096)
+def closest_simplified_pattern(word):
+    """Return the simplified pattern closest to a query word, or None; the spoken
+    vocabulary is small, so most words are answered from cache"""
+    matches = get_close_matches(word, SIMPLIFIED_PATTERNS, n=1, cutoff=0.8)
+    return matches[0] if matches else None
+
 # Category mapping for fallback responses if no exact match is found
 CATEGORY_FALLBACKS = {
     "buying": "When buying a property, key considerations include your budget, location preferences, must-have features, and long-term plans. Getting pre-approved for a mortgage is an essential first step to understand your budget. Our agents can guide you through the entire process from property search to closing. What specific aspect of home buying are you interested in?",
@@ -172,34 +238,53 @@ CATEGORY_KEYWORDS = {
     "property": ["property", "home", "house", "condo", "townhouse", "land", "acre", "square foot", "bedroom", "bathroom"]
 }
 
+# Inverted index from each distinct keyword to the categories that list it
+KEYWORD_CATEGORIES = {}
+for _category, _category_keywords in CATEGORY_KEYWORDS.items():
+    for _keyword in _category_keywords:
+        KEYWORD_CATEGORIES.setdefault(_keyword, []).append(_category)
+
+# Matches if any keyword occurs anywhere in a query
+CATEGORY_KEYWORD_RE = re.compile('|'.join(re.escape(keyword) for keyword in KEYWORD_CATEGORIES))
+
+# Normalization tables built once; ASCII queries are lowercased and stripped of
+# punctuation in a single bytes.translate pass
+PUNCTUATION_TRANSLATOR = str.maketrans('', '', string.punctuation)
+PUNCTUATION_BYTES = string.punctuation.encode('ascii')
+LOWERCASE_BYTES = bytes.maketrans(string.ascii_uppercase.encode('ascii'), string.ascii_lowercase.encode('ascii'))
+
 def preprocess_query(query):
     """Clean and normalize the query for better matching"""
     if not query:
         return ""
         
-    # Convert to lowercase
-    query = query.lower().strip()
-    
-    # Remove punctuation
-    translator = str.maketrans('', '', string.punctuation)
-    query = query.translate(translator)
-    
-    return query
+    # Convert to lowercase, remove punctuation, then trim
+    try:
+        return query.encode('ascii').translate(LOWERCASE_BYTES, PUNCTUATION_BYTES).decode('ascii').strip()
+    except UnicodeEncodeError:
+        return query.lower().translate(PUNCTUATION_TRANSLATOR).strip()
 
 def identify_category(query):
     """Identify which real estate category the query belongs to"""
-    preprocessed = preprocess_query(query)
-    
-    # Count keyword matches for each category
-    category_scores = {}
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        score = sum(1 for keyword in keywords if keyword in preprocessed)
-        category_scores[category] = score
+    return identify_normalized_category(preprocess_query(query))
+
+def identify_normalized_category(preprocessed):
+    """Identify the category of an already normalized query"""
+    # Most queries reaching this point contain no category keyword at all
+    if not CATEGORY_KEYWORD_RE.search(preprocessed):
+        return None
+    
+    # Count keyword matches for each category, testing each distinct keyword once
+    category_scores = dict.fromkeys(CATEGORY_KEYWORDS, 0)
+    for keyword, categories in KEYWORD_CATEGORIES.items():
+        if keyword in preprocessed:
+            for category in categories:
+                category_scores[category] += 1
     
     # Return the category with the highest score, or None if no matches
-    max_category = max(category_scores.items(), key=lambda x: x[1])
-    if max_category[1] > 0:
-        return max_category[0]
+    max_category = max(category_scores, key=category_scores.get)
+    if category_scores[max_category] > 0:
+        return max_category
     return None
 
 def get_response(query):
@@ -207,58 +292,48 @@ def get_response(query):
     Check if the query matches any patterns in our knowledge base
     Returns: (response_text, found_match)
     """
-    try:
-        if not query:
-            logger.warning("Empty query received")
-            return None, False
-            
-        # Normalize the query
-        normalized_query = preprocess_query(query)
-        
-        # Log the query we're trying to match
-        logger.debug(f"Attempting to match query: '{normalized_query}'")
+    if not query:
+        logger.warning("Empty query received")
+        return None, False
         
-        # Search for matching patterns
-        for pattern, response in REAL_ESTATE_KB.items():
-            # Check for a match with regex
-            if re.search(pattern, normalized_query, re.IGNORECASE):
-                logger.info(f"Found knowledge base match with pattern: {pattern}")
+    # Normalize the query; repeats of the same normalized query are served from cache.
+    # Every pattern is compiled at import, so nothing here is expected to raise;
+    # anything unexpected reaches the caller instead of being masked as a miss
+    return lookup_normalized(preprocess_query(query))
+
+@lru_cache(maxsize=4096)
+def lookup_normalized(normalized_query):
+    """
+    Match an already normalized query against the knowledge base; the result
+    depends only on the query, so it is cached and logging happens on misses only
+    Returns: (response_text, found_match)
+    """
+    # Log the query we're trying to match
+    logger.debug("Attempting to match query: '%s'", normalized_query)
+    
+    # Search for matching patterns, unless no pattern's leading word is present
+    match = any(literal in normalized_query for literal in KB_LITERALS) and KB_RE.match(normalized_query)
+    if match:
+        index = int(match.lastgroup[1:])
+        logger.info("Found knowledge base match with pattern: %s", KB_PATTERNS[index])
+        return KB_RESPONSES[index], True
+    
+    # If no regex match, try fuzzy matching with the simplified patterns
+    significant_parts = (part for part in normalized_query.split() if len(part) > 3)
+    for q_part in significant_parts:
+        closest = closest_simplified_pattern(q_part)
+        if closest:
+            logger.info("Found fuzzy match: %s for query part: %s", closest, q_part)
+            response = SIMPLIFIED_TO_RESPONSE[closest]
+            if response is not None:
                 return response, True
-        
-        # If no regex match, try fuzzy matching with the patterns
-        pattern_strings = [p.replace(r'.*', ' ').replace('|', ' ').replace('(', '').replace(')', '') 
-                          for p in REAL_ESTATE_KB.keys()]
-        
-        # Simplify patterns for better matching
-        simplified_patterns = []
-        for p in pattern_strings:
-            # Extract main keywords
-            words = p.split()
-            keywords = [w for w in words if len(w) > 3]  # Only keep significant words
-            if keywords:
-                simplified_patterns.append(' '.join(keywords))
-        
-        # Try to find close matches
-        query_parts = normalized_query.split()
-        for q_part in query_parts:
-            if len(q_part) > 3:  # Only consider significant words
-                matches = get_close_matches(q_part, simplified_patterns, n=1, cutoff=0.8)
-                if matches:
-                    logger.info(f"Found fuzzy match: {matches[0]} for query part: {q_part}")
-                    # Find the original pattern that corresponds to this match
-                    for pattern, response in REAL_ESTATE_KB.items():
-                        if matches[0] in pattern.replace(r'.*', ' ').replace('|', ' ').replace('(', '').replace(')', ''):
-                            return response, True
-        
-        # If still no match, see if we can categorize the query
-        category = identify_category(normalized_query)
-        if category and category in CATEGORY_FALLBACKS:
-            logger.info(f"Using category fallback for: {category}")
-            return CATEGORY_FALLBACKS[category], True
-        
-        # If no match was found
-        logger.info("No knowledge base match found")
-        return None, False
-    except Exception as e:
-        logger.error(f"Error in knowledge base lookup: {str(e)}")
-        return None, False
\ No newline at end of file
+    
+    # If still no match, see if we can categorize the query
+    category = identify_normalized_category(normalized_query)
+    if category and category in CATEGORY_FALLBACKS:
+        logger.info("Using category fallback for: %s", category)
+        return CATEGORY_FALLBACKS[category], True
+    
+    # If no match was found
+    logger.info("No knowledge base match found")
+    return None, False
\ No newline at end of file
@@ -0,0 +1,107 @@
+import logging
+import threading
+
+# Sentence embeddings are optional; without them the cache stays disabled
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    np = None
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """
+    Answers near-duplicate questions from earlier responses using sentence embeddings.
+    Entries are held in a fixed-size matrix and the least recently used one is evicted when full.
+    """
+    
+    def __init__(self, model_name='all-MiniLM-L6-v2', maxsize=1024, threshold=0.9):
+        self.model_name = model_name
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.enabled = SentenceTransformer is not None
+        self._model = None
+        self._vectors = None
+        self._values = [None] * maxsize
+        self._last_used = None
+        self._count = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        
+        if not self.enabled:
+            logger.info("sentence-transformers not installed, semantic cache disabled")
+    
+    def load(self, blocking=True):
+        """Load the embedding model and allocate the cache; CallHandler.warmup() calls
+        this so the first caller doesn't wait on it. A model that fails to load
+        disables the cache rather than being retried on every query."""
+        if not self._load_lock.acquire(blocking):
+            return
+        try:
+            if not self.enabled or self._model is not None:
+                return
+            try:
+                model = SentenceTransformer(self.model_name)
+                dim = model.get_sentence_embedding_dimension()
+            except Exception as e:
+                logger.error("Could not load embedding model %s, semantic cache disabled: %s", self.model_name, e)
+                self.enabled = False
+                return
+            self._vectors = np.zeros((self.maxsize, dim), dtype=np.float32)
+            self._last_used = np.zeros(self.maxsize, dtype=np.int64)
+            self._model = model
+            logger.info("Loaded embedding model %s for semantic cache", self.model_name)
+        finally:
+            self._load_lock.release()
+    
+    def _encode(self, text):
+        """Return the unit-length embedding of text, or None if the model isn't available"""
+        if self._model is None:
+            # Without warmup the first caller loads the model; callers arriving
+            # during a load skip the cache instead of waiting for it
+            self.load(blocking=False)
+            if self._model is None:
+                return None
+        return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+    
+    def lookup(self, query):
+        """
+        Find a cached answer for a semantically similar query
+        
+        Returns:
+            Tuple of (embedding, cached value or None); pass the embedding back to store()
+        """
+        if not self.enabled:
+            return None, None
+        vector = self._encode(query)
+        if vector is None:
+            return None, None
+        with self._lock:
+            if self._count == 0:
+                return vector, None
+            # Cosine similarity is a dot product on normalized vectors
+            similarities = self._vectors[:self._count] @ vector
+            best = int(similarities.argmax())
+            if similarities[best] < self.threshold:
+                return vector, None
+            self._tick += 1
+            self._last_used[best] = self._tick
+            return vector, self._values[best]
+    
+    def store(self, vector, value):
+        """Cache value under the embedding returned by lookup()"""
+        if vector is None or not self.enabled:
+            return
+        with self._lock:
+            if self._count < self.maxsize:
+                slot = self._count
+                self._count += 1
+            else:
+                slot = int(self._last_used.argmin())
+            self._tick += 1
+            self._vectors[slot] = vector
+            self._values[slot] = value
+            self._last_used[slot] = self._tick